@@ -0,0 +1,243 @@
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+import uuid
+from multiprocessing import shared_memory
+
+from sources import TelemetrySource
+
+# Acquisition in another process. The ingest daemon (daemon.py) reads and
+# decodes the serial link, records, and appends every sample to a ring in
+# shared memory; the dashboard maps the ring read-only and never shares a
+# GIL with the reader.
+#
+# Shared memory layout: eight uint64 header words followed by `capacity`
+# rows of float64 (parse time, arrival time, one value per channel).
+# The writer fills row count % capacity and only then bumps count, so a
+# reader copies rows up to the count it saw and afterwards drops any the
+# writer may have lapped in the meantime. MAGIC is written last, a reader
+# that finds it can trust the rest of the header.
+HEADER = struct.Struct('<8Q')
+COUNT, STATE, CHANNELS, CAPACITY, PID, MAGIC = range(6)
+RING_MAGIC = 0x676e6972656c6574
+WORD = struct.Struct('<Q')
+STATES = ('disconnected', 'searching', 'connected', 'stale', 'reconnecting')
+# Ring of the standalone daemon
+DEFAULT_NAME = 'driverinterface'
+
+
+def ring_size(channels, capacity):
+    return HEADER.size + 8 * capacity * (channels + 2)
+
+
+class SharedTelemetryWriter(object):
+    # Takes the place of the TelemetryStore in the child's IngestPipeline:
+    # the pipeline sets stamp and calls publish for every sample
+    def __init__(self, name, channels, capacity=8192):
+        self.channels = tuple(channels)
+        self.capacity = capacity
+        self.row = struct.Struct('<%dd' % (len(self.channels) + 2))
+        self.shm = shared_memory.SharedMemory(name, create=True, size=ring_size(len(self.channels), capacity))
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, 0, 0, len(self.channels), capacity, os.getpid(), 0, 0, 0)
+        WORD.pack_into(self.buf, MAGIC * 8, RING_MAGIC)
+        self.count = 0
+        self.stamp = (0.0, 0.0)
+
+    def publish(self, sample):
+        arrival, parsed = self.stamp
+        offset = HEADER.size + (self.count % self.capacity) * self.row.size
+        self.row.pack_into(self.buf, offset, parsed, arrival, *sample)
+        self.count += 1
+        WORD.pack_into(self.buf, COUNT * 8, self.count)
+
+    def set_state(self, state):
+        WORD.pack_into(self.buf, STATE * 8, STATES.index(state))
+
+    def close(self):
+        self.set_state('disconnected')
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedTelemetryReader(object):
+    # Read-only view of a writer's ring. On Linux the segment is mapped
+    # straight from /dev/shm with PROT_READ, which also keeps the
+    # multiprocessing resource tracker from unlinking it when we exit.
+    # A ring the writer is still setting up raises ValueError.
+    def __init__(self, name):
+        path = os.path.join('/dev/shm', name)
+        if os.path.exists(path):
+            self.shm = None
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+            self.buf = memoryview(self.map)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            self.map = None
+            self.buf = self.shm.buf
+        try:
+            self._check_header()
+        except ValueError:
+            self.close()
+            raise
+        header = HEADER.unpack_from(self.buf, 0)
+        self.channels = header[CHANNELS]
+        self.capacity = header[CAPACITY]
+        self.pid = header[PID]
+        self.row = struct.Struct('<%dd' % (self.channels + 2))
+        self.next = 0
+        self.overruns = 0
+
+    def _check_header(self):
+        size = len(self.buf)
+        if size < HEADER.size:
+            raise ValueError("Shared ring has no header yet")
+        header = HEADER.unpack_from(self.buf, 0)
+        if header[MAGIC] != RING_MAGIC:
+            raise ValueError("Shared ring header not written yet")
+        if not header[CHANNELS] or not header[CAPACITY]:
+            raise ValueError("Shared ring header is empty")
+        if size < ring_size(header[CHANNELS], header[CAPACITY]):
+            raise ValueError("Shared ring is smaller than its header says")
+
+    @property
+    def count(self):
+        return WORD.unpack_from(self.buf, COUNT * 8)[0]
+
+    @property
+    def state(self):
+        return STATES[WORD.unpack_from(self.buf, STATE * 8)[0]]
+
+    def read(self):
+        # Rows published since the previous call, oldest first
+        count = self.count
+        first = max(self.next, count - self.capacity)
+        self.overruns += first - self.next
+        unpack_from = self.row.unpack_from
+        size = self.row.size
+        capacity = self.capacity
+        rows = [unpack_from(self.buf, HEADER.size + (i % capacity) * size) for i in range(first, count)]
+        # Rows the writer lapped while we were copying them may be torn
+        lapped = self.count - capacity - first + 1
+        if lapped > 0:
+            self.overruns += lapped
+            rows = rows[lapped:]
+        self.next = count
+        return rows
+
+    def close(self):
+        self.buf.release()
+        if self.map is not None:
+            self.map.close()
+        else:
+            self.shm.close()
+
+
+class SharedMemorySource(TelemetrySource):
+    # Feeds the samples another process publishes into a shared ring to
+    # the handler. The thread only wakes every poll_interval to copy new
+    # rows out; if the writer goes away it waits for it to come back.
+    def __init__(self, name, poll_interval=0.002):
+        super(SharedMemorySource, self).__init__()
+        self.name = name
+        self.poll_interval = poll_interval
+        self.reader = None
+        self.samples = 0
+        self.overruns = 0
+
+    def writer_alive(self):
+        return os.path.exists(os.path.join('/dev/shm', self.name))
+
+    def attach(self):
+        self.set_state('searching')
+        while self.running:
+            try:
+                return SharedTelemetryReader(self.name)
+            except (FileNotFoundError, ValueError):
+                # Not there or not set up yet. Lets a source owning the
+                # writer notice that it exited
+                self.writer_alive()
+                time.sleep(max(self.poll_interval, 0.05))
+        return None
+
+    def run(self, handler):
+        while self.running:
+            reader = self.reader = self.attach()
+            if reader is None:
+                break
+            checked = time.monotonic()
+            while self.running:
+                rows = reader.read()
+                for row in rows:
+                    self.arrival = row[1]
+                    handler(row[2:])
+                self.samples += len(rows)
+                self.set_state(reader.state)
+                now = time.monotonic()
+                if now - checked > 0.5:
+                    checked = now
+                    if not self.writer_alive():
+                        break
+                time.sleep(self.poll_interval)
+            self.overruns += reader.overruns
+            self.reader = None
+            reader.close()
+        self.set_state('disconnected')
+
+    def counters(self):
+        return {
+            'state': self.state,
+            'samples': self.samples,
+            'overruns': self.overruns + (self.reader.overruns if self.reader else 0),
+        }
+
+
+class ProcessSource(SharedMemorySource):
+    # Runs `python daemon.py` with the given source arguments as a child
+    # process publishing into a private ring. Trip figures and alarms are
+    # computed by the dashboard, so the child skips them. Rate control has
+    # to run next to the serial port, in the child.
+    def __init__(self, argv, record_dir=None, cpu=None, poll_interval=0.002, rate_control=False):
+        super(ProcessSource, self).__init__('telemetry-%s' % uuid.uuid4().hex[:12], poll_interval)
+        self.argv = list(argv) + ['--no-trip', '--no-alarms']
+        if record_dir:
+            self.argv += ['--record', record_dir]
+        if cpu is not None:
+            self.argv += ['--cpu', str(cpu)]
+        if rate_control:
+            self.argv.append('--rate-control')
+        self.process = None
+
+    def start(self, handler):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'daemon.py')
+        self.process = subprocess.Popen([sys.executable, script, '--shm', self.name, '--quiet'] + self.argv)
+        super(ProcessSource, self).start(handler)
+
+    def writer_alive(self):
+        if self.process.poll() is not None:
+            print(f"Acquisition process exited with status {self.process.returncode}")
+            self.running = False
+            return False
+        return True
+
+    def stop(self):
+        super(ProcessSource, self).stop()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def counters(self):
+        counters = super(ProcessSource, self).counters()
+        counters['pid'] = self.process.pid if self.process else None
+        return counters
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from collections import namedtuple
+
+from telemetry import CHANNELS
+
+# Alarm rules live in alarms.json. Each rule has
+#   name       identifies the alarm
+#   channel    signal it watches
+#   kind       above, below (value), rate_above, rate_below (change per
+#              second, smoothed over `window` seconds) or code (raised
+#              while the channel is non-zero, e.g. the MCU error code)
+#   threshold  level that raises the alarm
+#   clear      level that clears it again (hysteresis, default threshold)
+#   debounce   seconds the condition must hold before raising or clearing
+#   severity   warning or critical
+#   message    shown while active; code rules format the code into it
+#              unless `codes` has a message for that code, and are raised
+#              again with the new message when the code changes
+# Rules are compiled into flat per-rule lists evaluated on the ingest
+# thread for every sample; only raise/clear transitions leave the engine.
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alarms.json')
+
+KINDS = ('above', 'below', 'rate_above', 'rate_below', 'code')
+ABOVE, BELOW, RATE_ABOVE, RATE_BELOW, CODE = range(len(KINDS))
+SEVERITIES = ('warning', 'critical')
+
+Alarm = namedtuple('Alarm', ('name', 'channel', 'active', 'severity', 'message', 'value', 't'))
+
+
+class AlarmEngine(object):
+    def __init__(self, rules, channels=CHANNELS, on_change=None):
+        self.channels = tuple(channels)
+        index = dict((name, i) for i, name in enumerate(self.channels))
+        self.rules = [rule for rule in rules if rule['channel'] in index]
+        for rule in self.rules:
+            if rule['kind'] not in KINDS:
+                raise ValueError("Unknown alarm kind %r in %s" % (rule['kind'], rule['name']))
+            if rule.get('severity', 'warning') not in SEVERITIES:
+                raise ValueError("Unknown severity %r in %s" % (rule['severity'], rule['name']))
+        rules = self.rules
+        self.on_change = on_change
+
+        # The evaluation table, one entry per rule in each list
+        self.names = [rule['name'] for rule in rules]
+        self.channel = [index[rule['channel']] for rule in rules]
+        self.kind = [KINDS.index(rule['kind']) for rule in rules]
+        self.threshold = [rule.get('threshold', 0) for rule in rules]
+        self.clear = [rule.get('clear', rule.get('threshold', 0)) for rule in rules]
+        self.debounce = [rule.get('debounce', 0.0) for rule in rules]
+        self.window = [rule.get('window', 1.0) for rule in rules]
+        self.severity = [rule.get('severity', 'warning') for rule in rules]
+        self.message = [rule.get('message', rule['name']) for rule in rules]
+        self.codes = [dict((int(k), v) for k, v in rule.get('codes', {}).items()) for rule in rules]
+
+        n = len(rules)
+        self.state = [False] * n
+        # Time the condition started disagreeing with the state, or None
+        self.pending = [None] * n
+        self.rate = [0.0] * n
+        self.previous = [None] * n
+        # Code each code rule was last raised with
+        self.code = [0] * n
+        # Active alarms by name, replaced on every transition
+        self.active = {}
+        self.transitions = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH, channels=CHANNELS, on_change=None):
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(spec['rules'], channels, on_change)
+
+    def evaluate(self, t, sample):
+        state = self.state
+        pending = self.pending
+        kind = self.kind
+        threshold = self.threshold
+        clear = self.clear
+        for i, channel in enumerate(self.channel):
+            value = sample[channel]
+            k = kind[i]
+            if k >= RATE_ABOVE and k != CODE:
+                previous = self.previous[i]
+                self.previous[i] = (t, value)
+                if previous is None or t <= previous[0]:
+                    continue
+                dt = t - previous[0]
+                self.rate[i] += ((value - previous[1]) / dt - self.rate[i]) * min(1.0, dt / self.window[i])
+                measured = self.rate[i]
+            else:
+                measured = value
+            active = state[i]
+            if k == ABOVE or k == RATE_ABOVE:
+                condition = measured > clear[i] if active else measured > threshold[i]
+            elif k == BELOW or k == RATE_BELOW:
+                condition = measured < clear[i] if active else measured < threshold[i]
+            else:
+                condition = measured != 0
+                if active and condition and int(measured) != self.code[i]:
+                    # Another code while raised, debounced like a raise
+                    active = False
+            if condition == active:
+                pending[i] = None
+                continue
+            if pending[i] is None:
+                pending[i] = t
+            if t - pending[i] >= self.debounce[i]:
+                pending[i] = None
+                self._transition(i, condition, value, t)
+
+    def _transition(self, i, active, value, t):
+        self.state[i] = active
+        self.transitions += 1
+        message = self.message[i]
+        if not active:
+            # Clears carry the message they were raised with
+            message = self.active[self.names[i]].message
+        elif self.kind[i] == CODE:
+            code = self.code[i] = int(value)
+            message = self.codes[i].get(code, message % code if '%' in message else message)
+        alarm = Alarm(self.names[i], self.channels[self.channel[i]], active, self.severity[i], message, value, t)
+        with self._lock:
+            active_alarms = dict(self.active)
+            if active:
+                active_alarms[alarm.name] = alarm
+            else:
+                active_alarms.pop(alarm.name, None)
+            self.active = active_alarms
+        if self.on_change is not None:
+            self.on_change(alarm)
+
+    def worst(self, channel=None):
+        # Highest severity among the active alarms (on one channel), or None
+        levels = [SEVERITIES.index(a.severity) for a in self.active.values()
+                  if channel is None or a.channel == channel]
+        return SEVERITIES[max(levels)] if levels else None
+
+    def counters(self):
+        return {'rules': len(self.names), 'active': sorted(self.active), 'transitions': self.transitions}
+
+
+def load_alarms(path=None, channels=CHANNELS, on_change=None):
+    return AlarmEngine.load(path or DEFAULT_PATH, channels, on_change)
@@ -0,0 +1,64 @@
+import os
+
+from kivy.core.image import Image as CoreImage
+
+# All dashboard images are packed into one atlas (dashboard.atlas plus
+# dashboard-0.png next to this file) so startup decodes and uploads a
+# single texture. Rebuild it with `python assets.py` after changing an
+# image; it is also rebuilt on startup when stale and Pillow is installed.
+HERE = os.path.dirname(os.path.abspath(__file__))
+ATLAS = os.path.join(HERE, 'dashboard')
+ATLAS_SIZE = 1024
+ASSETS = ('speedometer.png', 'logo.png')
+
+_atlas = None
+_textures = {}
+
+
+def atlas_is_fresh():
+    path = ATLAS + '.atlas'
+    if not os.path.exists(path):
+        return False
+    built = os.path.getmtime(path)
+    return all(os.path.getmtime(os.path.join(HERE, name)) <= built for name in ASSETS)
+
+
+def build_atlas():
+    from kivy.atlas import Atlas
+    return Atlas.create(ATLAS, [os.path.join(HERE, name) for name in ASSETS], ATLAS_SIZE)
+
+
+def load_atlas():
+    global _atlas
+    if _atlas is not None:
+        return _atlas
+    if not atlas_is_fresh():
+        try:
+            build_atlas()
+        except Exception as e:
+            print(f"Texture atlas not rebuilt, loading images one by one: {e}")
+            return None
+    from kivy.atlas import Atlas
+    _atlas = Atlas(ATLAS + '.atlas')
+    return _atlas
+
+
+def get_texture(source):
+    # Textures are decoded once and shared by every widget using them
+    texture = _textures.get(source)
+    if texture is None:
+        atlas = load_atlas()
+        name = os.path.splitext(os.path.basename(source))[0]
+        if atlas is not None and name in atlas.textures:
+            texture = atlas.textures[name]
+        else:
+            texture = CoreImage(source).texture
+        _textures[source] = texture
+    return texture
+
+
+if __name__ == '__main__':
+    result = build_atlas()
+    if not result:
+        raise SystemExit("Images do not fit in a %dx%d atlas" % (ATLAS_SIZE, ATLAS_SIZE))
+    print(f"Built {ATLAS}.atlas")
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import pty
+import subprocess
+import time
+from array import array
+
+from protocol import encode_frame
+from telemetry import TelemetryStore
+from history import HistoryBuffer
+from pipeline import IngestPipeline
+from sources import SerialSource
+
+# Sample sequence numbers ride in the speed field, float32 keeps them exact
+SEQ_LIMIT = 1 << 24
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def encode(seq, mode):
+    if mode == 'binary':
+        return encode_frame((seq, 5000, 50, 40, 80, 30, 0))
+    return b'%d,5000,50,40,80,30,0\n' % seq
+
+
+def bench_ingest(rate, duration, mode):
+    # Writes frames into a pty at `rate` samples per second and reads them
+    # back through SerialSource and IngestPipeline, the same path the
+    # dashboard uses. Bytes the pty refuses because the reader fell behind
+    # count as dropped, like an overrun UART buffer.
+    master, slave = pty.openpty()
+    os.set_blocking(master, False)
+    port = os.ttyname(slave)
+
+    total = int(rate * duration)
+    sent_at = array('d', bytes(8 * total))
+    latencies = array('d')
+    last = [0.0]
+    store = TelemetryStore()
+    pipeline = IngestPipeline(store, HistoryBuffer(capacity=max(total, 1)))
+
+    def handler(values):
+        pipeline.update(values)
+        seq = int(values[0])
+        now = time.perf_counter()
+        last[0] = now
+        if seq < total:
+            latencies.append(now - sent_at[seq])
+
+    source = SerialSource(port, mode=mode, stale_after=1)
+    source.start(handler)
+    while source.state != 'connected':
+        time.sleep(0.01)
+
+    overruns = 0
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    seq = 0
+    while seq < total:
+        due = min(total, int((time.perf_counter() - start) * rate) + 1)
+        if due > seq:
+            batch = b''.join(encode(i % SEQ_LIMIT, mode) for i in range(seq, due))
+            now = time.perf_counter()
+            for i in range(seq, due):
+                sent_at[i] = now
+            try:
+                written = os.write(master, batch)
+            except BlockingIOError:
+                written = 0
+            if written < len(batch):
+                overruns += due - seq
+            seq = due
+        else:
+            time.sleep(min(0.001, (seq + 1) / rate - (time.perf_counter() - start)))
+    send_time = time.perf_counter() - start
+
+    # Let the reader drain what is left in the pty
+    deadline = time.perf_counter() + 2
+    while pipeline.samples < total - overruns and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = last[0] - start
+    cpu = time.process_time() - cpu_start
+    source.stop()
+    source.thread.join()
+    os.close(master)
+    os.close(slave)
+
+    received = pipeline.samples
+    return {
+        'rate': rate,
+        'mode': mode,
+        'sent': total,
+        'received': received,
+        'dropped': total - received,
+        'overruns': overruns,
+        'bad_frames': source.parser.bad_frames,
+        'reads': source.reads,
+        'throughput': received / elapsed if elapsed else 0.0,
+        'achieved_rate': total / send_time if send_time else 0.0,
+        'cpu_percent': 100.0 * cpu / elapsed if elapsed else 0.0,
+        'latency_p50_ms': 1000 * percentile(latencies, 50),
+        'latency_p99_ms': 1000 * percentile(latencies, 99),
+    }
+
+
+def bench_parse(count, mode):
+    # Parser alone, no I/O
+    from protocol import make_parser
+    data = b''.join(encode(i % SEQ_LIMIT, mode) for i in range(count))
+    parser = make_parser(mode)
+    chunk = 4096
+    samples = []
+    start = time.perf_counter()
+    for i in range(0, len(data), chunk):
+        parser.feed(data[i:i + chunk], samples.append)
+    elapsed = time.perf_counter() - start
+    return {'mode': mode, 'samples': len(samples), 'samples_per_s': len(samples) / elapsed}
+
+
+def time_calls(fn, iterations):
+    times = []
+    for i in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - t)
+    return {'mean_us': 1e6 * sum(times) / len(times), 'p99_us': 1e6 * percentile(times, 99)}
+
+
+def bench_widgets(iterations):
+    # Needs Kivy; the mock GL backend lets the widgets build without a display
+    os.environ.setdefault('KIVY_GL_BACKEND', 'mock')
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+    try:
+        from kivy.uix.label import Label
+        from widgets import Speedometer, BatteryIndicator, HorizontalBar, NumericReadout
+        gauge = Speedometer(max_value=300)
+        battery = BatteryIndicator()
+        bar = HorizontalBar()
+        label = Label(font_size=20)
+        readout = NumericReadout(prefix='Power: ')
+    except Exception as e:
+        return {'skipped': str(e)}
+
+    def set_speed(i):
+        gauge.value = i % 300
+
+    def set_soc(i):
+        battery.soc = i % 100
+
+    def set_bar(i):
+        bar.value = i % 100
+
+    def set_label(i):
+        label.text = 'Power: %d' % (i % 100)
+        label.texture_update()
+
+    def set_readout(i):
+        readout.value = i % 100
+
+    return {
+        'draw_speedometer': time_calls(lambda i: gauge.draw_speedometer(), iterations),
+        'speedometer_value': time_calls(set_speed, iterations),
+        'update_battery': time_calls(lambda i: battery.update_battery(), iterations),
+        'battery_soc': time_calls(set_soc, iterations),
+        'update_canvas': time_calls(lambda i: bar.update_canvas(), iterations),
+        'bar_value': time_calls(set_bar, iterations),
+        'label_text': time_calls(set_label, iterations),
+        'readout_value': time_calls(set_readout, iterations),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, list):
+            for item in value:
+                flat.update(flatten(item, '%s.%s.%s.' % (name, item.get('mode'), item.get('rate', ''))))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old, new):
+    old = flatten(old)
+    for key, value in sorted(flatten(new).items()):
+        if key in old and old[key]:
+            change = 100.0 * (value - old[key]) / old[key]
+            print(f"{key:60s} {old[key]:14.3f} -> {value:14.3f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless ingest and widget benchmarks')
+    parser.add_argument('--rates', default='100,1000,5000', help='comma separated samples per second')
+    parser.add_argument('--duration', type=float, default=3, help='seconds per rate')
+    parser.add_argument('--mode', choices=('binary', 'csv'), default='binary')
+    parser.add_argument('--iterations', type=int, default=2000, help='calls per widget benchmark')
+    parser.add_argument('--no-widgets', action='store_true', help='skip the Kivy widget timings')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', metavar='JSON', help='print changes against an earlier --output')
+    args = parser.parse_args()
+
+    results = {'revision': git_revision(), 'parse': [bench_parse(100000, args.mode)], 'ingest': []}
+    print(f"parse: {results['parse'][0]['samples_per_s']:.0f} samples/s")
+    for rate in [float(r) for r in args.rates.split(',')]:
+        result = bench_ingest(rate, args.duration, args.mode)
+        results['ingest'].append(result)
+        print(f"ingest {rate:.0f}/s: {result['throughput']:.0f} samples/s, dropped {result['dropped']}, "
+              f"p50 {result['latency_p50_ms']:.2f} ms, p99 {result['latency_p99_ms']:.2f} ms, "
+              f"cpu {result['cpu_percent']:.0f}%")
+    if not args.no_widgets:
+        results['widgets'] = bench_widgets(args.iterations)
+        for name, timing in results['widgets'].items():
+            if isinstance(timing, dict):
+                print(f"{name}: {timing['mean_us']:.1f} us mean, {timing['p99_us']:.1f} us p99")
+            else:
+                print(f"widgets skipped: {timing}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
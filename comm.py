@@ -1,3 +1,7 @@
+import os
+# Command line arguments are ours, not Kivy's
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
 from kivy.app import App
 from kivy.uix.label import Label
 from kivy.uix.floatlayout import FloatLayout
@@ -6,8 +10,10 @@ from kivy.clock import Clock
 from kivy.graphics import Color, Line, Rectangle
 from math import cos, sin, pi
 from kivy.core.window import Window
-import serial
-import threading
+import argparse
+from signals import load_signals
+from sources import SerialSource, add_source_arguments, make_source
+from telemetry import TelemetryStore
 
 class Speedometer(Label):
     value = NumericProperty(0)
@@ -40,9 +46,13 @@ class CarDashboard(FloatLayout):
     cell_temperature = NumericProperty(0)
     current_time = StringProperty("00:00")
 
-    def __init__(self, **kwargs):
+    def __init__(self, source=None, signals=None, **kwargs):
         super(CarDashboard, self).__init__(**kwargs)
 
+        # Channels and the speed scale come from the signal database
+        self.signals = signals or load_signals()
+        self.max_speed = self.signals['speed'].range[1]
+
         self.speedometer = Speedometer(font_size=80, size_hint=(None, None), size=(400, 400), pos_hint={'center_x': 0.5, 'center_y': 0.5})
         self.add_widget(self.speedometer)
 
@@ -62,50 +72,50 @@ class CarDashboard(FloatLayout):
         ojas_label = Label(text="OJAS", font_size=20, size_hint=(None, None), size=(self.width / 2, 50), pos_hint={"right": 0.95, "bottom": 0.05}, halign='right', valign='middle')
         self.add_widget(ojas_label)
 
-        self.serial_port = None
-        self.start_UART_thread()
+        self.telemetry = TelemetryStore(self.signals.names)
+        self.soc_index = self.telemetry.index['soc']
+        self.speed_index = self.telemetry.index['speed']
+        self.last_seq = 0
+
+        # Port discovery, decoding and reconnects are SerialSource's job
+        self.source = source or SerialSource(signals=self.signals)
+        self.source.start(self.update_data)
         Clock.schedule_interval(self.update_speedometer, 0.1)
 
-    def UARTRead(self):
-        try:
-            with serial.Serial('/dev/ttyACM0', 115200, timeout=1) as self.serial_port:
-                while True:
-                    dataa = self.serial_port.readline().decode('utf-8').strip()
-                    if dataa:
-                        match = dataa.split()
-                        if len(match) >= 2:
-                            # Update data on main thread
-                            self.update_data(match[0], match[1])
-        except serial.SerialException as e:
-            print(f"Serial Exception: {e}")
-
-    def update_data(self, soc, value):
-        # Schedule UI update on the main thread
-        Clock.schedule_once(lambda dt: self.update_speedometer(soc, value))
-
-    def update_speedometer(self, soc, value):
-        self.speedometer.soc = int(soc)
-        self.speedometer.value = int(value)
-        min = 0
-        max = 100  
-        self.speedometer.movement = -180 + (self.speedometer.value / max_speed) * 360
+    def update_data(self, values):
+        # Called from the source thread. Only the latest sample is kept, the
+        # main thread picks it up on the next tick
+        self.telemetry.publish(values)
+
+    def update_speedometer(self, dt):
+        seq, values, _ = self.telemetry.snapshot()
+        if seq == self.last_seq:
+            return
+        self.last_seq = seq
+        self.speedometer.soc = int(values[self.soc_index])
+        self.speedometer.value = int(values[self.speed_index])
+        self.speedometer.movement = -180 + (self.speedometer.value / self.max_speed) * 360
         self.speedometer.draw_speedometer()
 
-        color_value = max(min((1 - self.speedometer.value / 100) * 2, 1), 0)
+        color_value = max(min((1 - self.speedometer.value / self.max_speed) * 2, 1), 0)
         self.canvas.before.clear()
         with self.canvas.before:
             Color(0.5 + 0.5 * (1 - color_value), 0.5 * color_value, 0)
             Rectangle(pos=self.pos, size=self.size)
 
-    def start_UART_thread(self):
-        uart_thread = threading.Thread(target=self.UARTRead)
-        uart_thread.daemon = True
-        uart_thread.start()
-
 class CarDashboardApp(App):
+    def __init__(self, args, **kwargs):
+        super(CarDashboardApp, self).__init__(**kwargs)
+        self.args = args
+
     def build(self):
         Window.fullscreen = 'auto'
-        return CarDashboard()
+        return CarDashboard(source=make_source(self.args), signals=load_signals(self.args.signals))
+
+    def on_stop(self):
+        self.root.source.stop()
 
 if __name__ == '__main__':
-    CarDashboardApp().run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Minimal speed and SOC dashboard')
+    add_source_arguments(parser)
+    CarDashboardApp(parser.parse_args()).run()
\ No newline at end of file
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import signal
+import threading
+
+from acquisition import DEFAULT_NAME, SharedTelemetryReader, SharedTelemetryWriter
+from metrics import Metrics, process_age
+from pipeline import IngestPipeline
+from signals import load_signals
+from sources import add_source_arguments, make_source
+
+# Headless ingest: the dashboard's reader, decoder, trip computer, alarm
+# engine, recorder and publisher without Kivy. Samples go to a shared memory ring that the
+# dashboard attaches to with `intcom.py --source shared`.
+#
+#   python daemon.py --record recordings --publish 5600 --metrics ingest.json
+#
+# SIGUSR2 prints a metrics dump, SIGTERM or Ctrl-C stops it.
+METRICS_INTERVAL = 5
+
+
+def create_writer(name, channels, capacity):
+    # A ring left behind by a daemon that died is replaced, a live one is not
+    try:
+        return SharedTelemetryWriter(name, channels, capacity)
+    except FileExistsError:
+        try:
+            reader = SharedTelemetryReader(name)
+        except ValueError:
+            # Never finished by whoever created it
+            pid = None
+        else:
+            pid = reader.pid
+            reader.close()
+        try:
+            if pid is None:
+                raise ProcessLookupError
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            os.unlink(os.path.join('/dev/shm', name))
+            return SharedTelemetryWriter(name, channels, capacity)
+        except PermissionError:
+            pass
+        raise SystemExit("Ingest daemon already running as pid %d (%s)" % (pid, name))
+
+
+def print_alarm(alarm):
+    state = 'raised' if alarm.active else 'cleared'
+    print(f"{alarm.severity} {alarm.name} {state}: {alarm.message} ({alarm.channel} = {alarm.value:g})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless telemetry ingest')
+    add_source_arguments(parser)
+    parser.add_argument('--shm', default=DEFAULT_NAME, help='shared memory ring the dashboard attaches to')
+    parser.add_argument('--capacity', type=int, default=8192, help='samples kept in the shared ring')
+    parser.add_argument('--record', metavar='DIR', help='record the session under DIR')
+    parser.add_argument('--publish', type=int, metavar='PORT', help='serve live telemetry to pit-side clients on UDP PORT')
+    parser.add_argument('--metrics', metavar='FILE', help='write a JSON metrics dump to FILE every few seconds')
+    parser.add_argument('--no-trip', action='store_true', help='do not run the trip computer')
+    parser.add_argument('--alarms', metavar='FILE', help='alarm rules (default alarms.json)')
+    parser.add_argument('--no-alarms', action='store_true', help='do not evaluate alarm rules')
+    parser.add_argument('--rate-control', action='store_true',
+                        help='adjust the MCU frame rate to what ingest keeps up with (serial source only)')
+    parser.add_argument('--cpu', type=int, help='pin the process to this CPU')
+    parser.add_argument('--quiet', action='store_true', help='no status output')
+    args = parser.parse_args(argv)
+    if args.rate_control and (args.source != 'serial' or args.mode != 'binary'):
+        parser.error('--rate-control needs --source serial and --mode binary')
+
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+    channels = load_signals(args.signals).names
+    writer = create_writer(args.shm, channels, args.capacity)
+    metrics = Metrics()
+
+    # Optional stages are only imported when asked for
+    recorder = trip = alarms = publisher = None
+    if args.record:
+        from recorder import Recorder
+        recorder = Recorder(args.record, channels)
+        metrics.register('recorder', recorder.counters)
+    if not args.no_trip:
+        from trip import TripComputer
+        trip = TripComputer(channels)
+        metrics.register('trip', trip.counters)
+    if not args.no_alarms:
+        from alarms import load_alarms
+        alarms = load_alarms(args.alarms, channels, None if args.quiet else print_alarm)
+        metrics.register('alarms', alarms.counters)
+    if args.publish:
+        from publisher import TelemetryPublisher
+        publisher = TelemetryPublisher(channels, args.publish)
+        metrics.register('publisher', publisher.counters)
+
+    source = make_source(args)
+    source.on_state = writer.set_state
+    writer.set_state(source.state)
+    pipeline = IngestPipeline(writer, recorder=recorder, source=source, metrics=metrics, trip=trip,
+                              publisher=publisher, alarms=alarms)
+    metrics.register('source', source.counters)
+    metrics.register('pipeline', pipeline.counters)
+    rate_control = None
+    if args.rate_control and hasattr(source, 'send'):
+        from ratecontrol import RateController
+        rate_control = RateController(source, load_signals(args.signals), metrics)
+        metrics.register('rate_control', rate_control.counters)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, lambda *args: stopped.set())
+    signal.signal(signal.SIGUSR2, lambda *args: print(json.dumps(metrics.dump())))
+    source.start(pipeline.update)
+    if rate_control:
+        rate_control.start()
+    if not args.quiet:
+        print(f"Ingest running on {args.shm} after {process_age():.2f} s")
+    try:
+        while not stopped.wait(METRICS_INTERVAL if args.metrics else 0.5) and source.running:
+            if args.metrics:
+                metrics.write(args.metrics)
+    finally:
+        if rate_control:
+            rate_control.stop()
+        source.stop()
+        if source.thread is not None:
+            source.thread.join(2)
+        if recorder:
+            recorder.close()
+        if publisher:
+            publisher.close()
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
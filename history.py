@@ -0,0 +1,109 @@
+from array import array
+
+from telemetry import CHANNELS
+
+# NumPy is optional and only imported on the first decimate() call, it is
+# slow to import on the Pi and not needed to start drawing
+numpy = None
+_numpy_checked = False
+
+
+def _numpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+class HistoryBuffer(object):
+    # Fixed capacity columnar ring buffer, one preallocated array('d') per
+    # channel plus a timestamp column. Appending writes in place; the UI
+    # reads windows back as memoryviews over the same storage. There is a
+    # single writer (the reader thread), readers may see the oldest slots
+    # being overwritten, which is fine for charts.
+    def __init__(self, channels=CHANNELS, capacity=30000):
+        self.channels = tuple(channels)
+        self.index = dict((name, i) for i, name in enumerate(self.channels))
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = [array('d', bytes(8 * capacity)) for _ in self.channels]
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, sample):
+        head = self.head
+        self.times[head] = t
+        for column, value in zip(self.columns, sample):
+            column[head] = value
+        head += 1
+        self.head = 0 if head == self.capacity else head
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _segments(self, column, n):
+        # Oldest to newest, as at most two zero-copy memoryviews
+        n = min(n, self.count)
+        view = memoryview(column)
+        start = self.head - n
+        if start >= 0:
+            return (view[start:self.head],)
+        if not self.head:
+            # Just wrapped, the newest sample is the last slot
+            return (view[self.capacity + start:],)
+        return (view[self.capacity + start:], view[:self.head])
+
+    def window(self, name, n):
+        return self._segments(self.columns[self.index[name]], n)
+
+    def time_window(self, n):
+        return self._segments(self.times, n)
+
+    def since(self, t):
+        # Number of samples newer than t, by binary search over ring order
+        first = self.head - self.count
+        times = self.times
+        capacity = self.capacity
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[(first + mid) % capacity] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.count - lo
+
+    def decimate(self, name, n, buckets):
+        # Min/max envelope of the last n samples in `buckets` columns
+        segments = self.window(name, n)
+        n = sum(len(s) for s in segments)
+        if not n or buckets <= 0:
+            return [], []
+        np = _numpy()
+        if np is not None:
+            data = np.concatenate([np.frombuffer(s, dtype=np.float64) for s in segments])
+            if n <= buckets:
+                return data.tolist(), data.tolist()
+            per = n // buckets
+            trimmed = data[n - per * buckets:].reshape(buckets, per)
+            return trimmed.min(axis=1).tolist(), trimmed.max(axis=1).tolist()
+
+        data = segments[0] if len(segments) == 1 else segments[0].tolist() + segments[1].tolist()
+        if n <= buckets:
+            values = list(data)
+            return values, values
+        per = n // buckets
+        offset = n - per * buckets
+        mins = []
+        maxs = []
+        for i in range(offset, n, per):
+            chunk = data[i:i + per]
+            mins.append(min(chunk))
+            maxs.append(max(chunk))
+        return mins, maxs
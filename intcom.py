@@ -1,128 +1,69 @@
+import os
+# Command line arguments are ours, not Kivy's
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+
+from kivy.config import Config
+# Let Clock triggers from the UART thread wake the idle main loop
+Config.set('kivy', 'kivy_clock', 'interrupt')
+
 from kivy.app import App
 from kivy.uix.label import Label
 from kivy.uix.floatlayout import FloatLayout
 from kivy.properties import NumericProperty, StringProperty
-from kivy.clock import Clock
-from kivy.graphics import Color, Line, Rectangle
-from kivy.uix.image import Image
-from math import cos, sin, pi
 from kivy.core.window import Window
+from kivy.clock import Clock
+from widgets import Speedometer, BatteryIndicator, HorizontalBar, Backdrop, StripChart, PerfOverlay, NumericReadout
 from datetime import datetime
-import serial
-import threading
-
-class Speedometer(FloatLayout):
-    value = NumericProperty(0)
-    movement = NumericProperty(-180)
-    soc = NumericProperty(36)
-
-    def __init__(self, **kwargs):
-        super(Speedometer, self).__init__(**kwargs)
-        self.size_hint = (None, None)
-        self.size = (400, 400)
-        self.pos_hint = {'center_x': 0.3, 'center_y': 0.5}  # Adjusted for speedometer position
-
-        # Background image
-        self.bg_image = Image(source='speedometer.png', size=self.size, pos=self.pos)
-        self.add_widget(self.bg_image)
-
-        # Speedometer label for value display
-        self.speed_label = Label(font_size=20, color=(1, 1, 1, 1))
-        self.add_widget(self.speed_label)
-    
-        self.bind(size=self.update_canvas, pos=self.update_canvas)
-
-    def update_canvas(self, *args):
-        self.canvas.before.clear()
-        with self.canvas.before:
-            Color(1, 1, 1)
-            Rectangle(texture=self.bg_image.texture, size=self.size, pos=self.pos)
-        self.draw_speedometer()
-
-    def draw_speedometer(self):
-        self.canvas.clear()
-        with self.canvas:
-            Color(0, 0.7, 1)
-            Line(circle=(self.center_x, self.center_y, min(self.width, self.height) / 2 - 1), width=2)
-            Color(1, 0.2, 0)
-            angle = self.movement * pi / 180
-            Line(points=[self.center_x, self.center_y,
-                         self.center_x + (min(self.width, self.height) / 2 - 1) * 0.8 * cos(angle),
-                         self.center_y + (min(self.width, self.height) / 2 - 1) * 0.8 * sin(angle)],
-                 width=2)
-            self.speed_label.text = str(int(self.value))
-            self.speed_label.pos = (self.center_x - 10, self.center_y - 30)
-
-class BatteryIndicator(FloatLayout):
-    soc = NumericProperty(100)
-    
-    def __init__(self, **kwargs):
-        super(BatteryIndicator, self).__init__(**kwargs)
-        self.size_hint = (None, None)
-        self.size = (100, 150) 
-        self.pos_hint = {'x': 0.05, 'top': 0.95}  
-        self.update_battery()
-        self.bind(soc=self.update_battery)
-
-    def update_battery(self, *args):
-        self.canvas.clear()
-        with self.canvas:
-            # Battery outline
-            Color(0.5, 0.5, 0.5)  
-            Rectangle(pos=self.pos, size=self.size)
-
-            # Battery terminal
-            Color(0.5, 0.5, 0.5)
-            terminal_height = 20
-            terminal_width = 10
-            terminal_pos = (self.pos[0] + (self.width - terminal_width) / 2, self.pos[1] + self.height - terminal_height + 10)
-            Rectangle(pos=terminal_pos, size=(terminal_width, terminal_height))
-
-            # Battery body
-            Color(0.2, 0.2, 0.2)  # Dark gray color
-            Rectangle(pos=(self.pos[0] + 5, self.pos[1] + 10), size=(self.width - 10, self.height - 30))
-
-            # SOC level
-            soc_height = (self.height - 30) * (self.soc / 100.0)
-            if self.soc > 50:
-                Color(0, 1, 0)  # Green color
-            elif self.soc > 20:
-                Color(1, 1, 0)  # Yellow color
-            else:
-                Color(1, 0, 0)  # Red color
-            Rectangle(pos=(self.pos[0] + 5, self.pos[1] + 10), size=(self.width - 10, soc_height))
-
-class HorizontalBar(FloatLayout):
-    value = NumericProperty(0)
-    label_text = StringProperty('')
-
-    def __init__(self, **kwargs):
-        super(HorizontalBar, self).__init__(**kwargs)
-        self.size_hint = (None, None)
-        self.size = (300, 50)
-        self.bind(value=self.update_canvas)
-
-    def update_canvas(self, *args):
-        self.canvas.clear()
-        with self.canvas:
-            Color(0.5, 0.5, 0.5)
-            Rectangle(pos=self.pos, size=self.size)
-            Color(0, 1, 0)
-            Rectangle(pos=self.pos, size=(self.size[0] * (self.value / 100.0), self.size[1]))
+import argparse
+import json
+import signal
+from telemetry import TelemetryStore
+from scheduler import FrameScheduler
+from history import HistoryBuffer
+from pipeline import IngestPipeline
+from metrics import Metrics, process_age
+from sources import SerialSource, make_source, add_source_arguments, source_arguments
+from motion import FILTERS
+from signals import load_signals
+
+# History kept for the strip charts: 5 minutes at 200 Hz
+HISTORY_CAPACITY = 60000
+CHART_SECONDS = 120
+
+# F12 toggles the performance overlay, so does SIGUSR1; SIGUSR2 prints a metrics dump
+PERF_OVERLAY_KEY = 293
+METRICS_INTERVAL = 5
+
+# L starts a new lap; the trip line is redrawn once a second
+LAP_KEY = 108
+TRIP_INTERVAL = 1
+
+LINK_COLORS = {'connected': (0, 1, 0, 1), 'stale': (1, 1, 0, 1)}
+ALARM_COLORS = {'warning': (1, 1, 0, 1), 'critical': (1, 0, 0, 1)}
+
 
 class CarDashboard(FloatLayout):
     accelerator_pedal = NumericProperty(0)
     cell_temperature = NumericProperty(0)
     error_message = StringProperty("")
 
-    def __init__(self, **kwargs):
+    def __init__(self, source=None, record_dir=None, metrics_file=None, needle_filter='critical', signals=None,
+                 publish_port=None, rate_control=False, trip=True, alarms=True, alarms_file=None, **kwargs):
         super(CarDashboard, self).__init__(**kwargs)
 
-        self.speedometer = Speedometer()
+        # Channel names, ranges and deadbands come from the signal database
+        self.signals = signals or load_signals()
+
+        # Background and Ojas logo (bottom-right)
+        self.backdrop = Backdrop(self)
+
+        speed_min, speed_max = self.signals['speed'].range
+        self.speedometer = Speedometer(min_value=speed_min, max_value=speed_max, needle_filter=needle_filter)
         self.add_widget(self.speedometer)
 
         # RPM Meter (similar to Speedometer)
-        self.rpm_meter = Speedometer()
+        rpm_min, rpm_max = self.signals['rpm'].range
+        self.rpm_meter = Speedometer(min_value=rpm_min, max_value=rpm_max, needle_filter=needle_filter)
         self.rpm_meter.pos_hint = {'center_x': 0.7, 'center_y': 0.5}  # Adjusted for RPM meter position
         self.add_widget(self.rpm_meter)
 
@@ -131,25 +72,20 @@ class CarDashboard(FloatLayout):
         self.add_widget(self.battery_indicator)
 
         # Battery SOC Label
-        self.battery_soc_label = Label(text="SOC: 100%", font_size=20, color=(1, 1, 1, 1), pos_hint={"x": -0.4225, "top": 1.4})
+        self.battery_soc_label = NumericReadout(prefix="SOC: ", suffix="%", digits=3, value=100, pos_hint={"x": -0.4225, "top": 1.4})
         self.add_widget(self.battery_soc_label)
 
         # Cell Temperature Label (top-right)
-        self.cell_temperature_label = Label(text=str(self.cell_temperature) + '°C', font_size=20, color=(1, 1, 1, 1),
-                                            size_hint=(None, None), size=(self.width / 2, 50), pos_hint={"right": 0.95, "top": 0.95},
-                                            halign='right', valign='middle')
+        self.cell_temperature_label = NumericReadout(suffix='°C', digits=3, value=self.cell_temperature,
+                                                     size_hint=(None, None), size=(self.width / 2, 50), pos_hint={"right": 0.95, "top": 0.95})
         self.add_widget(self.cell_temperature_label)
 
-        # Error Message Label (bottom-left)
+        # Active alarms (bottom-left)
         self.error_message_label = Label(text=self.error_message, font_size=20, color=(1, 1, 1, 1),
                                          size_hint=(None, None), size=(self.width / 2, 50), pos_hint={"left": 0.05, "bottom": 0.05},
                                          halign='left', valign='middle')
         self.add_widget(self.error_message_label)
 
-        # Ojas Image (bottom-right)
-        self.logo_image = Image(source='logo.png', size_hint=(None, None), size=(200, 200), pos_hint={"right": 0.95, "bottom": 0.05})
-        self.add_widget(self.logo_image)
-
         # Power and Current Bars
         self.power_bar = HorizontalBar(pos_hint={"center_x": 0.4, "top": 0.85}, label_text='Power: ')
         self.current_bar = HorizontalBar(pos_hint={"center_x": 0.6, "top": 0.85}, label_text='Current: ')
@@ -157,91 +93,260 @@ class CarDashboard(FloatLayout):
         self.add_widget(self.current_bar)
 
         # Power Label
-        self.power_label = Label(text="Power: 0", font_size=20, color=(1, 1, 1, 1), pos_hint={"center_x": 0.4, "top": 1.325})
+        self.power_label = NumericReadout(prefix="Power: ", pos_hint={"center_x": 0.4, "top": 1.325})
         self.add_widget(self.power_label)
 
         # Current Label
-        self.current_label = Label(text="Current: 0", font_size=20, color=(1, 1, 1, 1), pos_hint={"center_x": 0.6, "top": 1.325})
+        self.current_label = NumericReadout(prefix="Current: ", pos_hint={"center_x": 0.6, "top": 1.325})
         self.add_widget(self.current_label)
 
-        self.serial_port = None
-        self.start_UART_thread()
-
-        Clock.schedule_interval(self.update_dashboard, 0.1)
-
-    def UARTRead(self):
-        try:
-            with serial.Serial('/dev/ttyACM0', 115200, timeout=1) as self.serial_port:
-                while True:
-                    data = self.serial_port.readline().decode('utf-8').strip()
-                    if data:
-                        values = data.split(',')
-                        if len(values) >= 7:
-                            self.update_data(values)
-        except serial.SerialException as e:
-            print(f"Error opening or communicating over serial port: {e}")
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-
-    def start_UART_thread(self):
-        uart_thread = threading.Thread(target=self.UARTRead)
-        uart_thread.daemon = True
-        uart_thread.start()
+        # Serial link state (top-center)
+        self.link_label = Label(text="", font_size=16, color=(1, 0, 0, 1),
+                                size_hint=(None, None), size=(200, 30), pos_hint={"center_x": 0.5, "top": 0.98})
+        self.add_widget(self.link_label)
+
+        # Trip computer summary (bottom-center)
+        self.trip_label = Label(text="", font_size=16, color=(1, 1, 1, 1),
+                                size_hint=(None, None), size=(500, 30), pos_hint={"center_x": 0.5, "y": 0.02})
+        self.add_widget(self.trip_label)
+
+        # Strip charts and the performance overlay are built after the
+        # first frame, see build_deferred
+        self.history = HistoryBuffer(self.signals.names, capacity=HISTORY_CAPACITY)
+        self.metrics = Metrics()
+        self.power_chart = None
+        self.current_chart = None
+        self.perf_overlay = None
+
+        # Widgets are only updated when their channel changes, nothing is polled
+        self.telemetry = TelemetryStore(self.signals.names)
+        self.scheduler = FrameScheduler(self.telemetry, metrics=self.metrics)
+        self.bindings = {
+            'speed': self.set_speed,
+            'rpm': self.set_rpm,
+            'power': self.set_power,
+            'current': self.set_current,
+            'soc': self.set_soc,
+            'cell_temp': self.set_cell_temperature,
+        }
+        for name, callback in self.bindings.items():
+            if name in self.signals.by_name:
+                self.scheduler.bind(name, callback, self.signals[name].deadband)
+
+        # Optional stages are only imported when asked for
+        self.source = source or SerialSource()
+        self.recorder = self.trip = self.alarms = self.publisher = None
+        if record_dir:
+            from recorder import Recorder
+            self.recorder = Recorder(record_dir, self.signals.names)
+        if trip:
+            from trip import TripComputer
+            self.trip = TripComputer(self.signals.names)
+        if alarms:
+            # Alarm rules run on the ingest thread, only transitions reach the UI
+            from alarms import load_alarms
+            self.alarms = load_alarms(alarms_file, self.signals.names, self.update_alarm)
+            self._alarm_trigger = Clock.create_trigger(self.set_alarms)
+            self.battery_indicator.level = 'normal'
+        elif 'error' in self.signals.by_name:
+            # No engine: the battery colour follows the SOC on its own and
+            # the raw MCU error code is shown as it comes
+            self.scheduler.bind('error', self.set_error, self.signals['error'].deadband)
+        if publish_port:
+            from publisher import TelemetryPublisher
+            self.publisher = TelemetryPublisher(self.signals.names, publish_port)
+        self.pipeline = IngestPipeline(self.telemetry, self.history, self.recorder, self.scheduler.notify,
+                                       source=self.source, metrics=self.metrics, trip=self.trip,
+                                       publisher=self.publisher, alarms=self.alarms)
+
+        self.metrics.register('source', self.source.counters)
+        self.metrics.register('pipeline', self.pipeline.counters)
+        self.metrics.register('scheduler', self.scheduler.counters)
+        if self.trip:
+            self.metrics.register('trip', self.trip.counters)
+        if self.alarms:
+            self.metrics.register('alarms', self.alarms.counters)
+        if self.recorder:
+            self.metrics.register('recorder', self.recorder.counters)
+        if self.publisher:
+            self.metrics.register('publisher', self.publisher.counters)
+
+        # Ask the MCU for as much data as parsing and drawing keep up with
+        self.rate_control = None
+        if rate_control and hasattr(self.source, 'send'):
+            from ratecontrol import RateController
+            self.rate_control = RateController(self.source, self.signals, self.metrics)
+            self.metrics.register('rate_control', self.rate_control.counters)
+            self.rate_control.start()
+        Window.bind(on_draw=self.on_frame_drawing, on_flip=self.on_frame_presented, on_key_down=self.on_key_down)
+        signal.signal(signal.SIGUSR1, lambda *args: Clock.schedule_once(self.toggle_perf_overlay))
+        signal.signal(signal.SIGUSR2, lambda *args: print(json.dumps(self.metrics.dump())))
+        self.metrics_file = metrics_file
+        if metrics_file:
+            Clock.schedule_interval(self.write_metrics, METRICS_INTERVAL)
+        if self.trip:
+            Clock.schedule_interval(self.update_trip, TRIP_INTERVAL)
+
+        self.source.on_state = self.update_link_state
+        self.set_link_state(self.source.state)
+        self.source.start(self.update_data)
 
     def update_data(self, values):
-        try:
-            speed, rpm, power, current, soc, cell_temp, error = map(float, values[:6]) + [values[6]]
-            self.speedometer.value = speed
-            self.speedometer.movement = -180 + (speed / 300 * 180)
-            self.rpm_meter.value = rpm
-            self.rpm_meter.movement = -180 + (rpm / 10000 * 180)
-            self.power_bar.value = power
-            self.power_label.text = f"Power: {int(power)}"
-            self.current_bar.value = current
-            self.current_label.text = f"Current: {int(current)}"
-            self.battery_indicator.soc = soc
-            self.battery_soc_label.text = f"SOC: {int(soc)}%"
-            self.cell_temperature = cell_temp
-            self.cell_temperature_label.text = f"{int(cell_temp)}°C"
-            self.error_message = error
-            self.error_message_label.text = error
-        except ValueError:
-            print(f"Invalid value received: {values}")
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-
-    def update_dashboard(self, dt):
-        self.dummy_soc -= 0.1
-        if self.dummy_soc < 0:
-            self.dummy_soc = 100
-
-        self.dummy_value += 1
-        if self.dummy_value > 300:
-            self.dummy_value = 0
-
-        self.dummy_rpm += 100
-        if self.dummy_rpm > 10000:
-            self.dummy_rpm = 0
-
-        self.dummy_power = (self.dummy_value / 300) * 100
-        self.dummy_current = (self.dummy_value / 300) * 100
-
-        # self.speedometer.value = self.dummy_value
-        # self.speedometer.movement = -180 + (self.dummy_value / 300 * 180)
-        # self.rpm_meter.value = self.dummy_rpm
-        # self.rpm_meter.movement = -180 + (self.dummy_rpm / 10000 * 180)
-        # self.power_bar.value = self.dummy_power
-        # self.power_label.text = f"Power: {int(self.dummy_power)}"
-        # self.current_bar.value = self.dummy_current
-        # self.current_label.text = f"Current: {int(self.dummy_current)}"
-        # self.battery_indicator.soc = self.dummy_soc
-        # self.battery_soc_label.text = f"SOC: {int(self.dummy_soc)}%"
-        # self.cell_temperature_label.text = f"{int(self.cell_temperature)}°C"
-        # self.error_message_label.text = self.error_message
+        # Called from the source thread, every sample goes to the history,
+        # only the latest one to the widgets
+        self.pipeline.update(values)
+
+    def build_deferred(self, dt):
+        # Power and Current history below the bars
+        self.power_chart = StripChart(self.history, 'power', seconds=CHART_SECONDS, pos_hint={"center_x": 0.4, "top": 0.78})
+        self.current_chart = StripChart(self.history, 'current', seconds=CHART_SECONDS, pos_hint={"center_x": 0.6, "top": 0.78})
+        self.add_widget(self.power_chart)
+        self.add_widget(self.current_chart)
+        self.scheduler.bind('power', self.power_chart.request_refresh)
+        self.scheduler.bind('current', self.current_chart.request_refresh)
+
+        # Performance overlay (top-left, hidden until toggled)
+        self.perf_overlay = PerfOverlay(self.metrics, pos_hint={"x": 0.2, "top": 0.98})
+        self.add_widget(self.perf_overlay)
+
+    def on_frame_drawing(self, *args):
+        # Bound handlers run before the window's own on_draw renders
+        self.metrics.drawing()
+
+    def on_frame_presented(self, *args):
+        self.metrics.presented()
+        if self.metrics.first_frame is None:
+            self.metrics.first_frame = process_age()
+            print(f"First frame after {self.metrics.first_frame:.2f} s")
+            Clock.schedule_once(self.build_deferred)
+
+    def toggle_perf_overlay(self, *args):
+        if self.perf_overlay:
+            self.perf_overlay.toggle()
+
+    def on_key_down(self, window, key, *args):
+        if key == PERF_OVERLAY_KEY:
+            self.toggle_perf_overlay()
+            return True
+        if key == LAP_KEY and self.trip:
+            self.trip.lap()
+            self.update_trip()
+            return True
+
+    def write_metrics(self, dt):
+        self.metrics.write(self.metrics_file)
+
+    def update_trip(self, *args):
+        # Aggregates are computed on the ingest thread, this only formats them
+        results = self.trip.results
+        if not results:
+            return
+        lap = results['lap']
+        session = results['session']
+        text = f"Lap {results['laps'] + 1}: {lap.energy_wh:.0f} Wh  {session.wh_per_km:.0f} Wh/km"
+        if session.range_km is not None:
+            text += f"  Range {session.range_km:.0f} km"
+        self.trip_label.text = text
+
+    def update_link_state(self, state):
+        # Called from the source thread, state changes are rare
+        Clock.schedule_once(lambda dt: self.set_link_state(state))
+
+    def set_link_state(self, state):
+        self.link_label.text = "Link: " + state
+        self.link_label.color = LINK_COLORS.get(state, (1, 0, 0, 1))
+
+    def set_speed(self, speed):
+        self.speedometer.set_value(speed, self.telemetry.stamp[0])
+
+    def set_rpm(self, rpm):
+        self.rpm_meter.set_value(rpm, self.telemetry.stamp[0])
+
+    def set_power(self, power):
+        self.power_bar.value = power
+        self.power_label.value = int(power)
+
+    def set_current(self, current):
+        self.current_bar.value = current
+        self.current_label.value = int(current)
+
+    def set_soc(self, soc):
+        self.battery_indicator.soc = soc
+        self.battery_soc_label.value = int(soc)
+
+    def set_cell_temperature(self, cell_temp):
+        self.cell_temperature = cell_temp
+        self.cell_temperature_label.value = int(cell_temp)
+
+    def set_error(self, error):
+        self.error_message = 'Error E%d' % error if error else ''
+        self.error_message_label.text = self.error_message
+        self.error_message_label.color = ALARM_COLORS['critical'] if error else (1, 1, 1, 1)
+
+    def update_alarm(self, alarm):
+        # Called from the source thread on raise and clear only, transitions
+        # within a frame are drawn together
+        self._alarm_trigger()
+
+    def set_alarms(self, *args):
+        alarms = self.alarms
+        active = sorted(alarms.active.values(), key=lambda alarm: (alarm.severity != 'critical', alarm.t))
+        self.error_message = '  '.join(alarm.message for alarm in active)
+        self.error_message_label.text = self.error_message
+        self.error_message_label.color = ALARM_COLORS.get(alarms.worst(), (1, 1, 1, 1))
+        self.battery_indicator.level = alarms.worst('soc') or 'normal'
+        self.backdrop.set_level(alarms.worst() or 'normal')
 
 class CarDashboardApp(App):
+    def __init__(self, args, **kwargs):
+        super(CarDashboardApp, self).__init__(**kwargs)
+        self.args = args
+
     def build(self):
-        return CarDashboard()
+        record_dir = self.args.record
+        rate_control = self.args.rate_control
+        if self.args.acquire_process:
+            # Reading, decoding, recording and rate control move to their
+            # own process
+            from acquisition import ProcessSource
+            source = ProcessSource(source_arguments(self.args), record_dir, self.args.acquire_cpu,
+                                   rate_control=rate_control)
+            record_dir = None
+            rate_control = False
+        else:
+            source = make_source(self.args)
+        return CarDashboard(source=source, record_dir=record_dir,
+                            metrics_file=self.args.metrics, needle_filter=self.args.needle_filter,
+                            signals=load_signals(self.args.signals), publish_port=self.args.publish,
+                            rate_control=rate_control, trip=not self.args.no_trip,
+                            alarms=not self.args.no_alarms, alarms_file=self.args.alarms)
+
+    def on_stop(self):
+        if self.root.rate_control:
+            self.root.rate_control.stop()
+        self.root.source.stop()
+        if self.root.recorder:
+            self.root.recorder.close()
+        if self.root.publisher:
+            self.root.publisher.close()
 
 if __name__ == '__main__':
-    CarDashboardApp().run()
+    parser = argparse.ArgumentParser(description='Car dashboard')
+    add_source_arguments(parser)
+    parser.add_argument('--record', metavar='DIR', help='record the session under DIR')
+    parser.add_argument('--needle-filter', choices=FILTERS, default='critical',
+                        help='needle motion between samples: critically damped, constant velocity or none')
+    parser.add_argument('--metrics', metavar='FILE', help='write a JSON metrics dump to FILE every few seconds')
+    parser.add_argument('--publish', type=int, metavar='PORT', help='serve live telemetry to pit-side clients on UDP PORT')
+    parser.add_argument('--no-trip', action='store_true', help='do not run the trip computer')
+    parser.add_argument('--alarms', metavar='FILE', help='alarm rules (default alarms.json)')
+    parser.add_argument('--no-alarms', action='store_true', help='do not evaluate alarm rules, show SOC and error codes directly')
+    parser.add_argument('--rate-control', action='store_true',
+                        help='adjust the MCU frame rate to what the dashboard keeps up with (serial source only)')
+    parser.add_argument('--acquire-process', action='store_true',
+                        help='read the serial link in a separate process that shares samples through shared memory')
+    parser.add_argument('--acquire-cpu', type=int, metavar='CPU', help='pin the acquisition process to this CPU')
+    args = parser.parse_args()
+    if args.rate_control and (args.source != 'serial' or args.mode != 'binary'):
+        parser.error('--rate-control needs --source serial and --mode binary')
+    CarDashboardApp(args).run()
@@ -0,0 +1,145 @@
+import json
+import os
+import time
+from bisect import bisect_left
+
+_imported = time.monotonic()
+
+
+def process_age():
+    # Seconds since this process started, from /proc on Linux and from
+    # the import of this module elsewhere
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported
+
+
+# Log spaced latency buckets, four per octave from 1 us to about 16 s
+BOUNDS = [1e-6 * 2 ** (i / 4.0) for i in range(97)]
+
+
+def bucket_percentile(counts, p):
+    # Upper bound of the bucket holding the p-th percentile of counts
+    n = sum(counts)
+    if not n:
+        return 0.0
+    rank = n * p / 100.0
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= rank:
+            return BOUNDS[min(i, len(BOUNDS) - 1)]
+    return BOUNDS[-1]
+
+
+class Histogram(object):
+    # Rolling latency histogram in fixed memory. Counts go into the current
+    # window; every `window` seconds it becomes the previous one, so the
+    # percentiles always cover the last one to two windows. `totals` never
+    # resets, callers that want their own interval diff two copies of it.
+    def __init__(self, window=10.0):
+        self.window = window
+        self.current = [0] * (len(BOUNDS) + 1)
+        self.previous = [0] * (len(BOUNDS) + 1)
+        self.totals = [0] * (len(BOUNDS) + 1)
+        self.rotated = time.monotonic()
+        self.total = 0
+
+    def add(self, seconds, now=None):
+        if now is None:
+            now = time.monotonic()
+        if now - self.rotated > self.window:
+            self.previous, self.current = self.current, self.previous
+            for i in range(len(self.current)):
+                self.current[i] = 0
+            self.rotated = now
+        i = bisect_left(BOUNDS, seconds)
+        self.current[i] += 1
+        self.totals[i] += 1
+        self.total += 1
+
+    def count(self):
+        return sum(self.current) + sum(self.previous)
+
+    def percentile(self, p):
+        return bucket_percentile([a + b for a, b in zip(self.current, self.previous)], p)
+
+
+STAGES = ('read_to_parse', 'parse_to_apply', 'apply_to_present', 'end_to_end', 'frame_time', 'draw_time')
+
+
+class Metrics(object):
+    # Latency of each hop a sample takes (bytes read, parsed, applied to a
+    # widget, frame presented) plus frame times. Stage histograms are fed by
+    # the pipeline, the scheduler and the window; counters are read from the
+    # objects that own them when a dump is taken. frame_time is the gap
+    # between presents, which includes idle time when nothing needs a
+    # redraw; draw_time is only the rendering of each frame.
+    def __init__(self, window=10.0):
+        self.histograms = dict((name, Histogram(window)) for name in STAGES)
+        self.sources = {}
+        self.pending = None
+        self.last_present = None
+        self.draw_started = None
+        self.started = time.monotonic()
+        # Seconds from process start to the first presented frame
+        self.first_frame = None
+
+    def add(self, stage, seconds, now=None):
+        self.histograms[stage].add(seconds, now)
+
+    def applied(self, arrival, parsed, now):
+        # A frame's worth of telemetry went into the widgets
+        self.add('parse_to_apply', now - parsed, now)
+        self.pending = (arrival, now)
+
+    def drawing(self, now=None):
+        # The window is about to render a frame
+        self.draw_started = time.monotonic() if now is None else now
+
+    def presented(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self.last_present is not None:
+            self.add('frame_time', now - self.last_present, now)
+        self.last_present = now
+        if self.draw_started is not None:
+            self.add('draw_time', now - self.draw_started, now)
+            self.draw_started = None
+        if self.pending is not None:
+            arrival, applied = self.pending
+            self.pending = None
+            self.add('apply_to_present', now - applied, now)
+            self.add('end_to_end', now - arrival, now)
+
+    def register(self, name, counters):
+        # counters() returns a dict of numbers, evaluated on every dump
+        self.sources[name] = counters
+
+    def fps(self):
+        frame = self.histograms['frame_time'].percentile(50)
+        return 1.0 / frame if frame else 0.0
+
+    def dump(self):
+        data = {'uptime': time.monotonic() - self.started, 'fps': self.fps(), 'first_frame_s': self.first_frame}
+        for name, histogram in self.histograms.items():
+            data[name] = {
+                'count': histogram.total,
+                'p50_ms': 1000 * histogram.percentile(50),
+                'p99_ms': 1000 * histogram.percentile(99),
+            }
+        for name, counters in self.sources.items():
+            data[name] = counters()
+        return data
+
+    def write(self, path):
+        # Written to a temporary file first so readers never see half a dump
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.dump(), f, indent=2)
+        os.replace(tmp, path)
@@ -0,0 +1,93 @@
+from math import exp
+
+FILTERS = ('none', 'critical', 'velocity')
+
+
+class NeedleFilter(object):
+    # Turns timestamped samples into a smooth position that can be sampled
+    # at any time, so needles move at the display rate instead of jumping
+    # once per sample.
+    #
+    # 'critical' follows the latest sample with a critically damped spring
+    # whose settle time is one sample interval (or `smoothing` seconds).
+    # 'velocity' extrapolates along the slope of the last two samples for
+    # at most one interval and blends away the error whenever a new sample
+    # corrects the prediction; without a new sample it eases back onto the
+    # last one. 'none' jumps straight to each sample.
+    def __init__(self, mode='critical', smoothing=0):
+        if mode not in FILTERS:
+            raise ValueError("Unknown needle filter: %s" % mode)
+        self.mode = mode
+        self.smoothing = smoothing
+        self.target = None
+        self.target_time = 0.0
+        self.slope = 0.0
+        self.interval = 0.1
+        self.position = 0.0
+        self.velocity = 0.0
+        self.time = None
+        self.error = 0.0
+
+    def reset(self, value, t):
+        self.target = self.position = value
+        self.target_time = t
+        self.time = t
+        self.velocity = self.slope = self.error = 0.0
+
+    def push(self, value, t):
+        if self.target is None or self.mode == 'none':
+            self.reset(value, t)
+            return
+        if self.mode == 'velocity':
+            # Whatever the needle shows now stays continuous, the jump
+            # between prediction and the new sample decays over time
+            self.error = self.sample(t) - value
+        dt = t - self.target_time
+        if dt > 0:
+            # Smoothed estimate of the sample interval
+            self.interval += (min(dt, 1.0) - self.interval) * 0.25
+            self.slope = (value - self.target) / dt
+        self.target = value
+        self.target_time = t
+
+    def horizon(self):
+        return self.smoothing or self.interval
+
+    def sample(self, now):
+        if self.target is None:
+            return 0.0
+        if self.mode == 'none':
+            return self.target
+        if self.mode == 'velocity':
+            # Run ahead for one interval, then ease back onto the sample if
+            # no newer one arrived (the value stopped changing)
+            horizon = self.horizon()
+            age = max(now - self.target_time, 0.0)
+            ahead = age if age < horizon else max(2 * horizon - age, 0.0)
+            decay = exp(-3.0 * age / horizon)
+            self.position = self.target + self.slope * ahead + self.error * decay
+            self.time = now
+            return self.position
+
+        # Exact step of a critically damped spring towards the target
+        dt = now - self.time if self.time is not None else 0.0
+        self.time = now
+        if dt <= 0:
+            return self.position
+        omega = 4.0 / self.horizon()
+        x = omega * dt
+        decay = exp(-x)
+        offset = self.position - self.target
+        temp = (self.velocity + omega * offset) * dt
+        self.velocity = (self.velocity - omega * temp) * decay
+        self.position = self.target + (offset + temp) * decay
+        return self.position
+
+    def settled(self, now, tolerance):
+        # True once the needle has come to rest on the latest sample
+        if self.target is None:
+            return True
+        if self.mode == 'velocity':
+            return (now - self.target_time >= 2 * self.horizon() and
+                    abs(self.error) * exp(-3.0 * (now - self.target_time) / self.horizon()) < tolerance)
+        return abs(self.position - self.target) < tolerance and abs(self.velocity) * self.horizon() < tolerance
@@ -0,0 +1,45 @@
+import time
+
+
+class IngestPipeline(object):
+    # Everything that happens to a decoded sample on the source thread:
+    # stamp it, append it to the history, hand it to the recorder, the trip
+    # computer, the alarm engine and the network publisher, publish it as
+    # the latest value and wake whoever draws it. Nothing in here imports
+    # Kivy, so the same path runs headless.
+    def __init__(self, store, history=None, recorder=None, notify=None, source=None, metrics=None, trip=None,
+                 publisher=None, alarms=None):
+        self.store = store
+        self.history = history
+        self.recorder = recorder
+        self.trip = trip
+        self.publisher = publisher
+        self.alarms = alarms
+        self.notify = notify
+        self.source = source
+        self.metrics = metrics
+        self.samples = 0
+
+    def update(self, values):
+        t = time.monotonic()
+        arrival = self.source.arrival if self.source is not None else t
+        if self.metrics is not None:
+            self.metrics.add('read_to_parse', t - arrival, t)
+        if self.history is not None:
+            self.history.append(t, values)
+        if self.recorder is not None:
+            self.recorder.record(t, values)
+        if self.trip is not None:
+            self.trip.add(t, values)
+        if self.alarms is not None:
+            self.alarms.evaluate(t, values)
+        if self.publisher is not None:
+            self.publisher.publish(t, values)
+        self.store.stamp = (arrival, t)
+        self.store.publish(values)
+        self.samples += 1
+        if self.notify is not None:
+            self.notify()
+
+    def counters(self):
+        return {'samples': self.samples}
@@ -0,0 +1,246 @@
+import struct
+from binascii import crc_hqx
+
+# Binary telemetry frame:
+#   sync (0xAA 0x55) | length (1 byte) | payload | crc16 (little endian)
+# The CRC is CRC-16/CCITT-FALSE over the length byte and the payload.
+SYNC = b'\xaa\x55'
+HEADER_SIZE = 3
+CRC_SIZE = 2
+CRC = struct.Struct('<H')
+
+# speed, rpm, power, current, soc, cell_temp, error code
+PAYLOAD = struct.Struct('<6fH')
+
+# Host to MCU commands are ASCII lines ending in a CRC-16 of the text in
+# hex, "RATE 150*1A2B". The MCU acknowledges every command it applied with
+# a control frame: a frame whose length byte is not the payload size and
+# whose body is the command text.
+MAX_CONTROL = 32
+
+
+def crc16(data):
+    return crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(values, payload=PAYLOAD):
+    body = bytes([payload.size]) + payload.pack(*values)
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def max_frame_rate(baudrate, payload=PAYLOAD):
+    # Frames per second the UART can carry at 10 bits a byte (start, 8 data,
+    # stop): 371 at 115200 baud with the built in payload
+    return baudrate // (10 * (HEADER_SIZE + payload.size + CRC_SIZE))
+
+
+def encode_command(text):
+    return b'%s*%04X\n' % (text, crc16(text))
+
+
+def decode_command(line):
+    # Command text of a line with a valid checksum, else None
+    text, star, check = line.strip().rpartition(b'*')
+    if not star:
+        return None
+    try:
+        crc = int(check, 16)
+    except ValueError:
+        return None
+    return text if crc == crc16(text) else None
+
+
+def encode_control(text):
+    body = bytes([len(text)]) + text
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def parse_error(field):
+    # CSV error fields come in as b'E5', b'5' or empty
+    field = field.strip().lstrip(b'Ee')
+    return int(field) if field else 0
+
+
+class FrameParser(object):
+    def __init__(self, payload=PAYLOAD, buffer_size=4096, decode=None):
+        # decode, if given, maps the unpacked tuple to the sample handed on.
+        # Control frames go to control(body) when it is set.
+        self.payload = payload
+        self.decode = decode
+        self.control = None
+        self.frame_size = HEADER_SIZE + payload.size + CRC_SIZE
+        # Most a pass can leave unparsed: a partial telemetry frame, or a
+        # header claiming a control frame whose CRC has not arrived yet
+        self.max_pending = max(self.frame_size, HEADER_SIZE + MAX_CONTROL + CRC_SIZE)
+        self.buffer = bytearray(max(buffer_size, 2 * self.max_pending))
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+        self.frames = 0
+        self.bad_frames = 0
+        self.dropped_bytes = 0
+        self.controls = 0
+
+    def _append(self, data):
+        n = len(data)
+        size = len(self.buffer)
+        if self.end + n > size:
+            # Compact the unparsed tail to the front of the buffer
+            pending = self.end - self.start
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+            if pending + n > size:
+                # Reader fell too far behind, keep only the newest bytes
+                if n >= size:
+                    self.dropped_bytes += pending + n - size
+                    data = data[n - size:]
+                    n = size
+                    self.start = self.end = 0
+                else:
+                    overflow = pending + n - size
+                    self.view[:pending - overflow] = self.view[overflow:pending]
+                    self.end = pending - overflow
+                    self.dropped_bytes += overflow
+        self.view[self.end:self.end + n] = data
+        self.end += n
+
+    def reset(self):
+        self.start = self.end = 0
+
+    def feed(self, data, handler):
+        # Less than max_pending bytes are left over after each pass, so
+        # chunks of this size always fit next to them
+        limit = len(self.buffer) - self.max_pending
+        if len(data) > limit:
+            data = memoryview(data)
+            for i in range(0, len(data), limit):
+                self._feed(data[i:i + limit], handler)
+        else:
+            self._feed(data, handler)
+
+    def _feed(self, data, handler):
+        self._append(data)
+        buf = self.buffer
+        view = self.view
+        unpack_from = self.payload.unpack_from
+        decode = self.decode
+        payload_size = self.payload.size
+        frame_size = self.frame_size
+        pos = self.start
+        end = self.end
+
+        # Control frames are shorter than telemetry ones, so look at every
+        # complete header rather than waiting for a full frame
+        while end - pos >= HEADER_SIZE:
+            sync = buf.find(SYNC, pos, end)
+            if sync < 0:
+                # Keep a trailing 0xAA, it may be the first half of a sync
+                keep = 1 if buf[end - 1] == 0xAA else 0
+                self.dropped_bytes += end - pos - keep
+                pos = end - keep
+                break
+            if sync != pos:
+                self.dropped_bytes += sync - pos
+                pos = sync
+                continue
+            length = buf[pos + 2]
+            if length != payload_size:
+                if self.control is not None and 0 < length <= MAX_CONTROL:
+                    crc_pos = pos + HEADER_SIZE + length
+                    if crc_pos + CRC_SIZE > end:
+                        break
+                    if crc16(view[pos + 2:crc_pos]) == CRC.unpack_from(buf, crc_pos)[0]:
+                        self.controls += 1
+                        self.control(bytes(view[pos + HEADER_SIZE:crc_pos]))
+                        pos = crc_pos + CRC_SIZE
+                        continue
+                # Not a frame we understand, resync on the next byte
+                self.bad_frames += 1
+                self.dropped_bytes += 1
+                pos += 1
+                continue
+            if end - pos < frame_size:
+                break
+            crc_pos = pos + HEADER_SIZE + payload_size
+            if crc16(view[pos + 2:crc_pos]) != CRC.unpack_from(buf, crc_pos)[0]:
+                self.bad_frames += 1
+                self.dropped_bytes += 1
+                pos += 1
+                continue
+            self.frames += 1
+            if decode is None:
+                handler(unpack_from(buf, pos + HEADER_SIZE))
+            else:
+                handler(decode(unpack_from(buf, pos + HEADER_SIZE)))
+            pos += frame_size
+
+        self.start = pos
+        if pos == end:
+            self.start = self.end = 0
+
+
+class LineParser(object):
+    # CSV fallback: one sample per line, fields converted in order, or the
+    # given columns converted in the order listed
+    def __init__(self, converters, sep=b',', buffer_size=4096, columns=None, decode=None):
+        self.converters = converters
+        self.columns = columns
+        self.fields = max(columns) + 1 if columns else len(converters)
+        self.decode = decode
+        self.sep = sep
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+
+        self.frames = 0
+        self.bad_frames = 0
+        self.dropped_bytes = 0
+
+    def reset(self):
+        del self.buffer[:]
+
+    def feed(self, data, handler):
+        buf = self.buffer
+        buf += data
+        converters = self.converters
+        columns = self.columns
+        decode = self.decode
+        pos = 0
+        while True:
+            nl = buf.find(b'\n', pos)
+            if nl < 0:
+                break
+            values = buf[pos:nl].split(self.sep)
+            pos = nl + 1
+            if len(values) < self.fields:
+                if len(values) > 1 or values[0].strip():
+                    self.bad_frames += 1
+                continue
+            try:
+                if columns is None:
+                    sample = tuple(convert(value) for convert, value in zip(converters, values))
+                else:
+                    sample = tuple(convert(values[i]) for convert, i in zip(converters, columns))
+                if decode is not None:
+                    sample = decode(sample)
+            except ValueError:
+                self.bad_frames += 1
+                continue
+            self.frames += 1
+            handler(sample)
+        del buf[:pos]
+        if len(buf) > self.buffer_size:
+            # No newline for a whole buffer, the line is garbage
+            self.dropped_bytes += len(buf)
+            del buf[:]
+
+
+CSV_CONVERTERS = (float, float, float, float, float, float, parse_error)
+
+
+def make_parser(mode='binary'):
+    if mode == 'binary':
+        return FrameParser()
+    if mode == 'csv':
+        return LineParser(CSV_CONVERTERS)
+    raise ValueError("Unknown telemetry mode: %s" % mode)
@@ -0,0 +1,271 @@
+import argparse
+import json
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from telemetry import CHANNELS
+
+# Live telemetry for pit-side clients over UDP. A client subscribes by
+# sending SUB to the publisher's port (and again at least every
+# SUBSCRIPTION_TIMEOUT seconds), UNSUB to leave. Every SUB is answered with
+# a DESC datagram with the channel names as JSON, so a client that lost it
+# gets it again by subscribing; then come DATA datagrams of batched samples:
+#   'TLMB' | channels (u16) | rows (u16) | sequence (u32)
+#   rows of host monotonic time (f64) and one f32 per channel
+# A sequence gap means datagrams were dropped, by the network or by the
+# publisher because the client was not keeping up.
+SUB = b'SUB'
+UNSUB = b'UNSUB'
+DESC = b'TLMD'
+DATA = b'TLMB'
+HEADER = struct.Struct('<4sHHI')
+MAX_DATAGRAM = 1400
+SUBSCRIPTION_TIMEOUT = 10.0
+DESCRIBE_RETRY = 0.5
+
+
+def row_struct(channels):
+    return struct.Struct('<d%df' % channels)
+
+
+class Subscriber(object):
+    def __init__(self, address, queue_size):
+        self.address = address
+        # Full queue drops the oldest datagram, never blocks the publisher
+        self.queue = deque(maxlen=queue_size)
+        # DESC is owed, sent ahead of the queue so it is never dropped
+        self.describe = True
+        self.seen = time.monotonic()
+        self.sent = 0
+        self.dropped = 0
+
+
+class TelemetryPublisher(object):
+    # publish() runs on the ingest thread and only appends to the current
+    # batch. A sender thread packs full (or flush_interval old) batches
+    # once, queues the datagram for every subscriber and sends what each
+    # socket will take.
+    def __init__(self, channels=CHANNELS, port=5600, host='0.0.0.0', batch_size=32,
+                 flush_interval=0.05, queue_size=64):
+        self.channels = tuple(channels)
+        self.row = row_struct(len(self.channels))
+        self.batch_size = max(1, min(batch_size, (MAX_DATAGRAM - HEADER.size) // self.row.size))
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.description = DESC + json.dumps({'channels': self.channels}).encode()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+
+        self.subscribers = {}
+        self._batch = []
+        self._batch_started = 0.0
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self.sequence = 0
+        self.samples = 0
+        self.batches = 0
+        self.datagrams = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='publisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, t, sample):
+        if not self.subscribers:
+            return
+        with self._lock:
+            batch = self._batch
+            if not batch:
+                self._batch_started = t
+            batch.append((t, sample))
+            if len(batch) >= self.batch_size:
+                self._ready.append(batch)
+                self._batch = []
+        self.samples += 1
+
+    def _take_batches(self):
+        with self._lock:
+            if self._batch and time.monotonic() - self._batch_started >= self.flush_interval:
+                self._ready.append(self._batch)
+                self._batch = []
+            batches = list(self._ready)
+            self._ready.clear()
+        return batches
+
+    def _pack(self, batch):
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        pack_into = self.row.pack_into
+        size = self.row.size
+        data = bytearray(HEADER.size + size * len(batch))
+        HEADER.pack_into(data, 0, DATA, len(self.channels), len(batch), self.sequence)
+        offset = HEADER.size
+        for t, sample in batch:
+            pack_into(data, offset, t, *sample)
+            offset += size
+        return bytes(data)
+
+    def _receive(self):
+        while True:
+            try:
+                message, address = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP port unreachable from a client that went away
+                continue
+            message = message.strip()
+            if message == SUB:
+                subscriber = self.subscribers.get(address)
+                if subscriber is None:
+                    self.subscribers[address] = subscriber = Subscriber(address, self.queue_size)
+                subscriber.describe = True
+                subscriber.seen = time.monotonic()
+            elif message == UNSUB:
+                self.subscribers.pop(address, None)
+
+    def _queue(self, datagram):
+        for subscriber in self.subscribers.values():
+            queue = subscriber.queue
+            if len(queue) == queue.maxlen:
+                subscriber.dropped += 1
+                self.dropped += 1
+            queue.append(datagram)
+
+    def _send(self, subscriber):
+        queue = subscriber.queue
+        while subscriber.describe or queue:
+            datagram = self.description if subscriber.describe else queue[0]
+            try:
+                self.sock.sendto(datagram, subscriber.address)
+            except (BlockingIOError, InterruptedError):
+                return False
+            except OSError:
+                pass
+            if subscriber.describe:
+                subscriber.describe = False
+            else:
+                queue.popleft()
+            subscriber.sent += 1
+            self.datagrams += 1
+            self.bytes_sent += len(datagram)
+        return True
+
+    def _run(self):
+        sock = self.sock
+        while self._running:
+            readable, writable, _ = select.select([sock], [], [], self.flush_interval / 2)
+            if readable:
+                self._receive()
+            now = time.monotonic()
+            for address, subscriber in list(self.subscribers.items()):
+                if now - subscriber.seen > SUBSCRIPTION_TIMEOUT:
+                    del self.subscribers[address]
+            for batch in self._take_batches():
+                self._queue(self._pack(batch))
+                self.batches += 1
+            for subscriber in list(self.subscribers.values()):
+                if not self._send(subscriber):
+                    # Socket buffer full, wait until it drains
+                    select.select([], [sock], [], self.flush_interval / 2)
+                    break
+
+    def counters(self):
+        return {
+            'subscribers': len(self.subscribers),
+            'samples': self.samples,
+            'batches': self.batches,
+            'datagrams': self.datagrams,
+            'bytes': self.bytes_sent,
+            'dropped': self.dropped,
+        }
+
+    def close(self):
+        self._running = False
+        self._thread.join(1)
+        self.sock.close()
+
+
+class TelemetrySubscriber(object):
+    # Client side: subscribes, renews the subscription and decodes batches
+    def __init__(self, host, port=5600, timeout=1.0):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+        self.channels = None
+        self.row = None
+        self.sequence = None
+        self.received = 0
+        self.lost = 0
+        self.renewed = 0.0
+
+    def subscribe(self):
+        self.sock.sendto(SUB, self.address)
+        self.renewed = time.monotonic()
+
+    def receive(self):
+        # Samples from the next datagram as (t, values) pairs; empty on a
+        # timeout or a description datagram
+        if time.monotonic() - self.renewed > SUBSCRIPTION_TIMEOUT / 2:
+            self.subscribe()
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return []
+        if data.startswith(DESC):
+            self.channels = tuple(json.loads(data[len(DESC):].decode())['channels'])
+            self.row = row_struct(len(self.channels))
+            return []
+        magic, channels, rows, sequence = HEADER.unpack_from(data)
+        if magic != DATA:
+            return []
+        if self.row is None:
+            # The description was lost, ask again (SUB is answered with it)
+            if time.monotonic() - self.renewed > DESCRIBE_RETRY:
+                self.subscribe()
+            return []
+        if self.sequence is not None:
+            self.lost += (sequence - self.sequence - 1) & 0xFFFFFFFF
+        self.sequence = sequence
+        self.received += rows
+        return [(values[0], values[1:]) for values in self.row.iter_unpack(data[HEADER.size:])]
+
+    def close(self):
+        try:
+            self.sock.sendto(UNSUB, self.address)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the rate of a live telemetry stream')
+    parser.add_argument('host')
+    parser.add_argument('--port', type=int, default=5600)
+    args = parser.parse_args()
+    subscriber = TelemetrySubscriber(args.host, args.port)
+    subscriber.subscribe()
+    last = time.monotonic()
+    count = 0
+    try:
+        while True:
+            rows = subscriber.receive()
+            count += len(rows)
+            now = time.monotonic()
+            if now - last >= 1:
+                latest = dict(zip(subscriber.channels or (), rows[-1][1])) if rows else {}
+                print(f"{count / (now - last):.0f} samples/s, {subscriber.lost} datagrams lost  {latest}")
+                last = now
+                count = 0
+    except KeyboardInterrupt:
+        subscriber.close()
@@ -0,0 +1,157 @@
+import threading
+import time
+
+from metrics import bucket_percentile
+from protocol import encode_command, max_frame_rate
+
+# Host side of the RATE / DIV command channel in uartSTM.c. Every interval
+# the controller looks at what the link and the dashboard measured and
+# moves the MCU frame rate: down by a factor when samples wait too long to
+# be parsed, frames take too long to draw or bytes get lost, up by a step while
+# everything has headroom, between min_rate and max_rate. Critical
+# channels (no `rate` in signals.json) come with every frame, so they get
+# all of it; slower channels are decimated on the MCU to their own rate.
+# Each step only looks at what was measured since the previous one, and
+# after a cut the controller holds still for `holdoff` seconds while the
+# backlog from the old rate drains. Commands carry a checksum and the MCU
+# acknowledges the ones it applied; unacknowledged settings are sent again
+# on the next step, and `confirmed` is the rate the MCU said it runs at.
+# The rate is only raised once the current one has been confirmed.
+BACKOFF = 0.7
+STEP = 1.1
+
+
+class RateController(object):
+    def __init__(self, source, signals, metrics=None, min_rate=10, max_rate=None, lag_budget=0.005,
+                 draw_budget=1 / 30.0, interval=1.0, resend_interval=10.0, holdoff=None):
+        self.source = source
+        self.signals = signals
+        self.metrics = metrics
+        self.min_rate = min_rate
+        # By default as fast as the link's baud rate allows for the frame size
+        if max_rate is None:
+            max_rate = max_frame_rate(source.baudrate, source.parser.payload)
+        self.max_rate = max_rate
+        self.lag_budget = lag_budget
+        self.draw_budget = draw_budget
+        self.interval = interval
+        self.resend_interval = resend_interval
+        self.holdoff = 2 * interval if holdoff is None else holdoff
+        self.hold_until = 0.0
+        self.totals = {}
+        self.rate = min_rate
+        # Last acknowledged command text by setting, b'RATE' or b'DIV <ch>'
+        self.acked = {}
+        self.acks = 0
+        self.last_send = 0.0
+        self.last_loss = 0
+        self.adjustments = 0
+        self.commands = 0
+        self.reason = ''
+        self._stop = threading.Event()
+        self._thread = None
+        source.on_control = self.acknowledge
+
+    def divisors(self, rate):
+        # Wire order channel index and frames each value is held for
+        result = []
+        for index, signal in enumerate(self.signals.fields):
+            frames = 1 if signal.rate is None else int(rate / signal.rate)
+            result.append((index, max(1, min(255, frames))))
+        return result
+
+    def commands_for(self, rate):
+        commands = [b'RATE %d' % rate]
+        commands.extend(b'DIV %d %d' % item for item in self.divisors(rate))
+        return commands
+
+    def acknowledge(self, text):
+        # Called from the source thread with an acknowledged command
+        self.acked[text.rpartition(b' ')[0]] = text
+        self.acks += 1
+
+    @property
+    def confirmed(self):
+        text = self.acked.get(b'RATE')
+        return int(text.split()[1]) if text else None
+
+    def interval_percentile(self, stage, p):
+        # Percentile of what the stage recorded since the previous call
+        totals = list(self.metrics.histograms[stage].totals)
+        last = self.totals.get(stage)
+        self.totals[stage] = totals
+        if last is not None:
+            totals = [a - b for a, b in zip(totals, last)]
+        return bucket_percentile(totals, p)
+
+    def measure(self):
+        # (parse lag p99, draw time p50, bytes lost) since the last step.
+        # Draw time, not the gap between frames: an idle dashboard presents
+        # rarely, and that is headroom rather than load.
+        lag = draw = 0.0
+        if self.metrics is not None:
+            lag = self.interval_percentile('read_to_parse', 99)
+            draw = self.interval_percentile('draw_time', 50)
+        counters = self.source.counters()
+        loss = counters.get('dropped_bytes', 0)
+        lost = loss - self.last_loss
+        self.last_loss = loss
+        return lag, draw, lost
+
+    def step(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        lag, draw, lost = self.measure()
+        rate = self.rate
+        if now < self.hold_until:
+            # Still the backlog of the rate before the last cut
+            self.reason = 'holdoff'
+        elif lost > 0 or lag > self.lag_budget or draw > self.draw_budget:
+            self.reason = 'loss' if lost > 0 else 'parse lag' if lag > self.lag_budget else 'draw time'
+            rate *= BACKOFF
+            self.hold_until = now + self.holdoff
+        elif self.confirmed != rate:
+            # Only climb from a rate the MCU has acknowledged
+            self.reason = 'unconfirmed'
+        elif lag < self.lag_budget / 2:
+            self.reason = 'headroom'
+            rate = rate * STEP + 1
+        rate = int(max(self.min_rate, min(self.max_rate, rate)))
+        if rate != self.rate:
+            self.adjustments += 1
+            self.rate = rate
+        self.send(rate, now)
+
+    def send(self, rate, now):
+        # Settings the MCU has not acknowledged yet, and now and then all
+        # of them in case it has reset
+        refresh = now - self.last_send > self.resend_interval
+        if refresh:
+            self.last_send = now
+        acked = self.acked
+        for command in self.commands_for(rate):
+            if refresh or acked.get(command.rpartition(b' ')[0]) != command:
+                self.source.send(encode_command(command))
+                self.commands += 1
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.step()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='ratecontrol')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def counters(self):
+        return {
+            'rate': self.rate,
+            'confirmed_rate': self.confirmed,
+            'acks': self.acks,
+            'adjustments': self.adjustments,
+            'commands': self.commands,
+            'reason': self.reason,
+        }
@@ -0,0 +1,223 @@
+import argparse
+import csv
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from telemetry import CHANNELS
+
+# Segment file layout: a 512 byte header followed by preallocated float64
+# columns of `capacity` rows each, host monotonic time first and then one
+# column per channel. Rows past `count` are unused.
+MAGIC = b'TLM1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQd256s')
+HEADER_SIZE = 512
+COUNT_OFFSET = 16
+
+
+def segment_size(channels, capacity):
+    return HEADER_SIZE + 8 * capacity * (len(channels) + 1)
+
+
+class Recorder(object):
+    # Records every sample to memory-mapped segment files. The reader
+    # thread only appends to a bounded deque; a background thread copies
+    # samples into the current segment and rotates to a new file when it
+    # is full. If the writer ever falls behind, the oldest queued samples
+    # are dropped and counted rather than blocking ingest.
+    def __init__(self, directory, channels=CHANNELS, segment_samples=360000, queue_size=20000):
+        self.channels = tuple(channels)
+        self.segment_samples = segment_samples
+        self.directory = os.path.join(directory, time.strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(self.directory, exist_ok=True)
+        # Maps host monotonic timestamps back to wall clock time
+        self.wall_offset = time.time() - time.monotonic()
+
+        self.queue = deque(maxlen=queue_size)
+        self.recorded = 0
+        self.dropped = 0
+        self.segments = 0
+
+        self._file = None
+        self._mmap = None
+        self._view = None
+        self._count = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='recorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, t, sample):
+        queue = self.queue
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append((t, sample))
+
+    def counters(self):
+        return {'queue': len(self.queue), 'recorded': self.recorded, 'dropped': self.dropped, 'segments': self.segments}
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+        self._close_segment()
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, 'segment-%04d.tlm' % self.segments)
+        self.segments += 1
+        size = segment_size(self.channels, self.segment_samples)
+        self._file = open(path, 'w+b')
+        self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        names = ','.join(self.channels).encode('ascii')
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, len(self.channels),
+                         self.segment_samples, 0, self.wall_offset, names)
+        self._view = memoryview(self._mmap)[HEADER_SIZE:].cast('d')
+        self._count = 0
+
+    def _close_segment(self):
+        if self._mmap is None:
+            return
+        self._sync()
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+        self._view = self._mmap = self._file = None
+
+    def _sync(self):
+        struct.pack_into('<Q', self._mmap, COUNT_OFFSET, self._count)
+
+    def _run(self):
+        queue = self.queue
+        last_flush = time.monotonic()
+        while self._running or queue:
+            if not queue:
+                time.sleep(0.02)
+                continue
+            if self._mmap is None:
+                self._open_segment()
+            view = self._view
+            capacity = self.segment_samples
+            while queue and self._count < capacity:
+                t, sample = queue.popleft()
+                row = self._count
+                view[row] = t
+                for column, value in enumerate(sample, 1):
+                    view[column * capacity + row] = value
+                self._count = row + 1
+                self.recorded += 1
+            self._sync()
+            if self._count == capacity:
+                self._close_segment()
+            elif time.monotonic() - last_flush > 1:
+                self._mmap.flush()
+                last_flush = time.monotonic()
+
+
+class Segment(object):
+    # Read-only view of one recorded segment
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, capacity, count, wall_offset, names = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a telemetry segment: %s" % path)
+        self.channels = tuple(names.rstrip(b'\0').decode('ascii').split(','))
+        self.capacity = capacity
+        self.count = count
+        self.wall_offset = wall_offset
+        view = memoryview(self._mmap)[HEADER_SIZE:].cast('d')
+        self.times = view[:count]
+        self.columns = [view[i * capacity:i * capacity + count] for i in range(1, n + 1)]
+
+    def column(self, name):
+        return self.columns[self.channels.index(name)]
+
+    def close(self):
+        self.times.release()
+        for column in self.columns:
+            column.release()
+        self._mmap.close()
+
+
+def session_segments(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.tlm'))
+
+
+def iter_session(directory):
+    # (time, sample) for every recorded row, in order
+    for path in session_segments(directory):
+        segment = Segment(path)
+        try:
+            columns = segment.columns
+            for row, t in enumerate(segment.times):
+                yield t, tuple(column[row] for column in columns)
+        finally:
+            segment.close()
+
+
+def export(directory, output, chunk_seconds=60, fmt='csv'):
+    # Writes one file per chunk_seconds of session time plus index.csv,
+    # so analysis can open the minute it needs without reading the rest
+    os.makedirs(output, exist_ok=True)
+    paths = session_segments(directory)
+    if not paths:
+        raise ValueError("No segments in %s" % directory)
+    first = Segment(paths[0])
+    channels = first.channels
+    start = first.times[0] if first.count else 0.0
+    first.close()
+
+    if fmt == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+
+    header = ('time',) + channels
+    index = []
+    rows = []
+    chunk = None
+
+    def write_chunk():
+        name = 'chunk-%05d.%s' % (chunk, fmt)
+        path = os.path.join(output, name)
+        if fmt == 'parquet':
+            table = pyarrow.table(dict((key, [row[i] for row in rows]) for i, key in enumerate(header)))
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+        index.append((chunk, rows[0][0], rows[-1][0], len(rows), name))
+
+    for t, sample in iter_session(directory):
+        rel = t - start
+        n = int(rel // chunk_seconds)
+        if n != chunk:
+            if rows:
+                write_chunk()
+            chunk = n
+            rows = []
+        rows.append((rel,) + sample)
+    if rows:
+        write_chunk()
+
+    with open(os.path.join(output, 'index.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('chunk', 'start', 'end', 'rows', 'file'))
+        writer.writerows(index)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a recorded telemetry session')
+    parser.add_argument('session', help='session directory containing segment-*.tlm files')
+    parser.add_argument('output', help='directory for the exported chunks and index.csv')
+    parser.add_argument('--chunk', type=float, default=60, help='seconds of data per output file')
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    args = parser.parse_args()
+    for chunk, start, end, rows, name in export(args.session, args.output, args.chunk, args.format):
+        print(f"{name}: {start:.1f}s - {end:.1f}s, {rows} rows")
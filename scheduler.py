@@ -0,0 +1,65 @@
+import time
+
+from kivy.clock import Clock
+
+
+class FrameScheduler(object):
+    # Pushes telemetry into widgets on demand. The reader thread calls
+    # notify() after publishing; that arms a single Clock trigger, so any
+    # number of samples arriving within one frame cost one update. A bound
+    # callback only runs when its channel moved by more than its deadband,
+    # and nothing at all runs while the data is unchanged.
+    def __init__(self, store, max_fps=30, metrics=None):
+        self.store = store
+        self.metrics = metrics
+        self.bindings = []
+        self.last_seq = 0
+        self.updates = 0
+        # Samples that arrived since the previous update, and in total
+        # samples that were never drawn because a newer one replaced them
+        self.batch = 0
+        self.coalesced = 0
+        self._trigger = Clock.create_trigger(self.update, 1.0 / max_fps)
+
+    def bind(self, name, callback, deadband=0):
+        # [channel index, deadband, callback, last applied value]
+        self.bindings.append([self.store.index[name], deadband, callback, None])
+
+    def notify(self):
+        self._trigger()
+
+    def refresh(self):
+        # Re-apply every binding on the next update, e.g. after a relayout
+        for binding in self.bindings:
+            binding[3] = None
+        self.last_seq = 0
+        self._trigger()
+
+    def update(self, dt=None):
+        seq, values, seqs = self.store.snapshot()
+        if seq == self.last_seq:
+            return
+        last_seq = self.last_seq
+        self.last_seq = seq
+        self.updates += 1
+        self.batch = seq - last_seq
+        self.coalesced += self.batch - 1
+        stamp = self.store.stamp
+        for binding in self.bindings:
+            index, deadband, callback, last = binding
+            if seqs[index] <= last_seq and last is not None:
+                continue
+            value = values[index]
+            if last is not None:
+                if deadband:
+                    if abs(value - last) <= deadband:
+                        continue
+                elif value == last:
+                    continue
+            binding[3] = value
+            callback(value)
+        if self.metrics is not None:
+            self.metrics.applied(stamp[0], stamp[1], time.monotonic())
+
+    def counters(self):
+        return {'updates': self.updates, 'batch': self.batch, 'coalesced': self.coalesced}
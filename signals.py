@@ -0,0 +1,157 @@
+import json
+import os
+import struct
+
+from protocol import FrameParser, LineParser, encode_frame, parse_error
+
+# Signal definitions live in signals.json. Each signal has
+#   name      channel name widgets and the store refer to
+#   type      struct code of the field in the binary payload (f, H, ...)
+#   offset    byte offset of the field in the binary payload
+#   index     column in the CSV fallback format
+#   scale     physical value = raw * scale + bias (default 1 and 0)
+#   units     shown next to the value
+#   range     [min, max] of the physical value, used to size gauges
+#   deadband  smallest change worth redrawing (default 0, any change)
+#   rate      samples per second the channel needs; channels without one
+#             are critical and come with every frame (see ratecontrol.py)
+# Adding a channel is a new entry here; the decoders are compiled from the
+# definitions at startup so per-sample cost does not depend on the loop.
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signals.json')
+
+INTEGER_TYPES = 'bBhHiIqQ'
+FLOAT_TYPES = 'efd'
+
+
+class Signal(object):
+    def __init__(self, name, type='f', offset=None, index=None, scale=1, bias=0, units='', range=None, deadband=0,
+                 rate=None):
+        if type not in INTEGER_TYPES + FLOAT_TYPES:
+            raise ValueError("Unsupported type %r for signal %s" % (type, name))
+        self.name = name
+        self.type = type
+        self.offset = offset
+        self.index = index
+        self.scale = scale
+        self.bias = bias
+        self.units = units
+        self.range = tuple(range) if range else (0, 100)
+        self.deadband = deadband
+        self.rate = rate
+
+    def expression(self, raw):
+        if self.scale != 1:
+            raw = '%s * %r' % (raw, self.scale)
+        if self.bias:
+            raw = '%s + %r' % (raw, self.bias)
+        return raw
+
+
+class SignalDatabase(object):
+    def __init__(self, signals):
+        self.signals = list(signals)
+        self.names = tuple(s.name for s in self.signals)
+        self.by_name = dict((s.name, s) for s in self.signals)
+        if len(self.by_name) != len(self.signals):
+            raise ValueError("Duplicate signal names")
+        self._compile_binary()
+        self._compile_csv()
+
+    @classmethod
+    def load(cls, path=DEFAULT_PATH):
+        with open(path) as f:
+            spec = json.load(f)
+        return cls(Signal(**entry) for entry in spec['signals'])
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def _compile_binary(self):
+        # One struct for the whole payload, fields in offset order with pad
+        # bytes for gaps, plus a decoder that reorders and scales into
+        # signal order. The decoder is skipped entirely when it would be
+        # the identity.
+        layout = []
+        position = 0
+        for signal in self.signals:
+            offset = position if signal.offset is None else signal.offset
+            layout.append((offset, signal))
+            position = offset + struct.calcsize('<' + signal.type)
+        layout.sort(key=lambda item: item[0])
+        fmt = '<'
+        position = 0
+        for offset, signal in layout:
+            if offset < position:
+                raise ValueError("Signal %s overlaps the previous field" % signal.name)
+            if offset > position:
+                fmt += '%dx' % (offset - position)
+            fmt += signal.type
+            position = offset + struct.calcsize('<' + signal.type)
+        self.payload = struct.Struct(fmt)
+        # Signals in the order they sit in the payload
+        self.fields = [signal for offset, signal in layout]
+        raw_position = dict((signal.name, i) for i, signal in enumerate(self.fields))
+        self.decode_binary = self._compile_decoder(raw_position)
+
+        # Inverse for encoders (simulators, tests)
+        self._encode_order = [self.names.index(signal.name) for signal in self.fields]
+
+    def _compile_csv(self):
+        signals = [s for s in self.signals if s.index is not None]
+        if len(signals) != len(self.signals):
+            self.columns = None
+            self.decode_csv = None
+            return
+        self.columns = [s.index for s in signals]
+        self.converters = [float if s.type in FLOAT_TYPES else parse_error for s in signals]
+        self.decode_csv = self._compile_decoder(dict((s.name, i) for i, s in enumerate(signals)))
+
+    def _compile_decoder(self, raw_position):
+        identity = all(raw_position[s.name] == i and s.scale == 1 and not s.bias
+                       for i, s in enumerate(self.signals))
+        if identity:
+            return None
+        body = ', '.join(s.expression('raw[%d]' % raw_position[s.name]) for s in self.signals)
+        namespace = {}
+        exec('def decode(raw):\n    return (%s,)\n' % body, namespace)
+        return namespace['decode']
+
+    def make_parser(self, mode='binary'):
+        if mode == 'binary':
+            return FrameParser(self.payload, decode=self.decode_binary)
+        if mode == 'csv':
+            if self.columns is None:
+                raise ValueError("Every signal needs an index for the CSV format")
+            return LineParser(self.converters, columns=self.columns, decode=self.decode_csv)
+        raise ValueError("Unknown telemetry mode: %s" % mode)
+
+    def encode_frame(self, sample):
+        raw = []
+        for i in self._encode_order:
+            signal = self.signals[i]
+            value = (sample[i] - signal.bias) / signal.scale
+            raw.append(int(round(value)) if signal.type in INTEGER_TYPES else value)
+        return encode_frame(raw, self.payload)
+
+    def encode_line(self, sample):
+        fields = [''] * (max(self.columns) + 1)
+        for signal, value in zip(self.signals, sample):
+            raw = (value - signal.bias) / signal.scale
+            if signal.type in INTEGER_TYPES:
+                fields[signal.index] = '%d' % round(raw)
+            else:
+                fields[signal.index] = repr(float(raw))
+        return (','.join(fields) + '\n').encode('ascii')
+
+
+_default = None
+
+
+def load_signals(path=None):
+    # The default database is loaded once and shared
+    global _default
+    if path is not None and path != DEFAULT_PATH:
+        return SignalDatabase.load(path)
+    if _default is None:
+        _default = SignalDatabase.load(DEFAULT_PATH)
+    return _default
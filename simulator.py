@@ -0,0 +1,331 @@
+import argparse
+import csv
+import json
+import math
+import os
+import pty
+import random
+import time
+import tty
+
+from protocol import decode_command, encode_control, max_frame_rate
+from signals import load_signals
+
+# Stand-in for the STM32 (uartSTM.c): plays a scripted drive cycle into a
+# pseudo-terminal in the dashboard's binary or CSV framing, so the reader
+# can be pointed at it with --port. Line noise flips bytes in random frames
+# and dropouts silence the link for a while; every frame is accounted for
+# in the report (and in the --log file, one row per frame), so what a
+# receiver got can be checked against what was sent. Like the firmware it
+# takes checksummed RATE and DIV commands on the way back and acknowledges
+# them (see uartSTM.c), which makes it the stand-in for testing host rate
+# control. Acknowledgements are control frames, so binary mode only.
+#
+#   python simulator.py --cycle endurance --rate 1000 --noise 0.001 --log sent.csv
+#   python intcom.py --port /dev/pts/N
+
+PACK_VOLTAGE = 400.0
+RPM_PER_KMH = 33.0
+
+
+def launch(t):
+    # Full throttle to 120 km/h, hold, brake to a stop; repeats every 25 s
+    t %= 25.0
+    if t < 8:
+        speed = 120 * (1 - math.exp(-t / 2.5))
+        power = 80 * math.exp(-t / 4)
+    elif t < 15:
+        speed = 120 * (1 - math.exp(-8 / 2.5))
+        power = 12
+    elif t < 20:
+        speed = 120 * (1 - math.exp(-8 / 2.5)) * (20 - t) / 5
+        power = -20
+    else:
+        speed = power = 0.0
+    return speed, power, 30 + min(t, 20) * 0.3, 0
+
+
+def endurance(t):
+    # 90 s laps of straights and corners, the pack slowly warming up
+    phase = 2 * math.pi * t / 90.0
+    speed = 70 + 35 * math.sin(phase) + 15 * math.sin(3 * phase)
+    power = 25 + 20 * math.cos(phase) + 10 * math.cos(3 * phase)
+    return speed, power, 30 + 15 * (1 - math.exp(-t / 600)), 0
+
+
+def thermal(t):
+    # Endurance with a cooling fault: cells heat up, power is derated from
+    # 55 °C and error 3 (overtemperature) is raised above 60 °C
+    speed, power, temp, error = endurance(t)
+    temp = 30 + t * 0.4
+    if temp > 55:
+        factor = max(0.0, 1 - (temp - 55) / 10)
+        speed *= 0.5 + 0.5 * factor
+        power *= factor
+    return speed, power, temp, 3 if temp > 60 else 0
+
+
+CYCLES = {'launch': launch, 'endurance': endurance, 'thermal': thermal}
+
+
+class DriveCycle(object):
+    # Samples of a cycle in the dashboard's channel order, with SOC drawn
+    # down by the energy used
+    def __init__(self, name, capacity_kwh=7.0):
+        self.profile = CYCLES[name]
+        self.capacity = capacity_kwh * 3600.0
+        self.energy = 0.0
+        self.last = 0.0
+
+    def sample(self, t):
+        speed, power, temp, error = self.profile(t)
+        self.energy += power * max(t - self.last, 0.0)
+        self.last = t
+        soc = max(0.0, 100.0 * (1 - self.energy / self.capacity))
+        current = power * 1000 / PACK_VOLTAGE
+        return {'speed': max(speed, 0.0), 'rpm': max(speed, 0.0) * RPM_PER_KMH, 'power': power,
+                'current': current, 'soc': soc, 'cell_temp': temp, 'error': error}
+
+
+class Simulator(object):
+    # Writes frames through write(bytes) -> bytes written, paced to `rate`
+    # samples per second. At high rates every write carries all frames due
+    # since the last one, as a UART DMA would.
+    def __init__(self, cycle='endurance', rate=100, mode='binary', signals=None, noise=0.0,
+                 dropout_every=0.0, dropout_for=0.0, sequence=False, seed=None, log=None, baudrate=115200):
+        self.cycle = DriveCycle(cycle)
+        self.rate = rate
+        self.mode = mode
+        self.signals = signals or load_signals()
+        self.encode = self.signals.encode_frame if mode == 'binary' else self.signals.encode_line
+        # Highest rate a RATE command may set, as on the MCU; --rate itself
+        # is not capped, the pty is faster than any UART
+        self.max_rate = max_frame_rate(baudrate, self.signals.payload)
+        self.noise = noise
+        self.dropout_every = dropout_every
+        self.dropout_for = dropout_for
+        self.sequence = sequence
+        self.random = random.Random(seed)
+        self.log = log
+        # Frames each channel's value is held for, set with DIV
+        self.divisors = [1] * len(self.signals.names)
+        self.held = [0] * len(self.signals.names)
+        self.command = bytearray()
+        self.commands = 0
+        self.rejected = 0
+        self.replies = []
+
+        self.frames = 0
+        self.sent = 0
+        self.corrupted = 0
+        self.dropouts = 0
+        self.overruns = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def in_dropout(self, t):
+        return self.dropout_every and t % self.dropout_every >= self.dropout_every - self.dropout_for
+
+    def frame(self, seq, t):
+        values = self.cycle.sample(t)
+        if self.sequence:
+            # Frame number in the speed field, for exact loss accounting
+            values['speed'] = seq
+        held = self.held
+        for c, name in enumerate(self.signals.names):
+            if seq % self.divisors[c] == 0:
+                held[c] = values.get(name, 0)
+        sample = tuple(held)
+        data = self.encode(sample)
+        status = 'sent'
+        if self.in_dropout(t):
+            status = 'dropout'
+        elif self.noise and self.random.random() < self.noise:
+            data = bytearray(data)
+            data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+            data = bytes(data)
+            status = 'corrupted'
+        return data, status, sample
+
+    def receive(self, data):
+        # Host commands, one line each: RATE <hz> or DIV <channel> <frames>
+        # followed by *<crc16 hex>. Lines that fail the checksum are dropped.
+        self.command += data
+        while b'\n' in self.command:
+            line, _, rest = bytes(self.command).partition(b'\n')
+            self.command = bytearray(rest)
+            text = decode_command(line)
+            if text is None:
+                self.rejected += 1
+                continue
+            words = text.split()
+            try:
+                if len(words) == 2 and words[0] == b'RATE' and 1 <= int(words[1]) <= self.max_rate:
+                    self.rate = int(words[1])
+                elif (len(words) == 3 and words[0] == b'DIV' and 0 <= int(words[1]) < len(self.divisors)
+                      and 1 <= int(words[2]) <= 255):
+                    self.divisors[int(words[1])] = int(words[2])
+                else:
+                    continue
+            except ValueError:
+                continue
+            self.commands += 1
+            if self.mode == 'binary':
+                self.replies.append(encode_control(text))
+
+    def run(self, write, duration=None, running=lambda: True, read=None):
+        start = time.monotonic()
+        seq = 0
+        # Cycle time and frame number the current rate counts from
+        base_time = 0.0
+        base_seq = 0
+        rate = float(self.rate)
+        while running():
+            now = time.monotonic() - start
+            if duration is not None and now >= duration:
+                break
+            if read is not None:
+                data = read()
+                if data:
+                    self.receive(data)
+                if self.replies:
+                    write(b''.join(self.replies))
+                    del self.replies[:]
+                if self.rate != rate:
+                    base_time += (seq - base_seq) / rate
+                    base_seq = seq
+                    rate = float(self.rate)
+            due = base_seq + int((now - base_time) * rate) + 1
+            if duration is not None:
+                due = min(due, base_seq + int((duration - base_time) * rate))
+            if due <= seq:
+                time.sleep(max(0.0, min(0.001, base_time + (seq + 1 - base_seq) / rate - now)))
+                continue
+            chunks = []
+            frames = []
+            for i in range(seq, due):
+                t = base_time + (i - base_seq) / rate
+                data, status, sample = self.frame(i, t)
+                if status != 'dropout':
+                    chunks.append(data)
+                frames.append((i, t, status, sample))
+            batch = b''.join(chunks)
+            written = write(batch) if batch else 0
+            self.account(frames, chunks, written)
+            seq = due
+        self.elapsed = time.monotonic() - start
+
+    def account(self, frames, chunks, written):
+        # Frames past what the port accepted were lost, like a UART overrun
+        offset = 0
+        chunk = 0
+        for i, t, status, sample in frames:
+            self.frames += 1
+            if status == 'dropout':
+                self.dropouts += 1
+            else:
+                offset += len(chunks[chunk])
+                chunk += 1
+                if offset > written:
+                    status = 'overrun'
+                    self.overruns += 1
+                else:
+                    self.sent += 1
+                    self.bytes += len(chunks[chunk - 1])
+                    if status == 'corrupted':
+                        self.corrupted += 1
+            if self.log is not None:
+                self.log.writerow((i, '%.6f' % t, status) + sample)
+
+    def report(self):
+        return {
+            'mode': self.mode,
+            'rate': self.rate,
+            'frames': self.frames,
+            'sent': self.sent,
+            'corrupted': self.corrupted,
+            'dropouts': self.dropouts,
+            'overruns': self.overruns,
+            'bytes': self.bytes,
+            'commands': self.commands,
+            'rejected_commands': self.rejected,
+            'final_rate': self.rate,
+            'elapsed': self.elapsed,
+            'achieved_rate': self.frames / self.elapsed if self.elapsed else 0.0,
+        }
+
+
+def open_pty(link=None):
+    # Master end for the simulator, slave path for the dashboard. The
+    # slave stays open here so the port survives the reader reconnecting.
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    os.set_blocking(master, False)
+    path = os.ttyname(slave)
+    if link:
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(path, link)
+    return master, slave, path
+
+
+def pty_writer(master):
+    def write(data):
+        try:
+            return os.write(master, data)
+        except BlockingIOError:
+            return 0
+    return write
+
+
+def pty_reader(master):
+    def read():
+        try:
+            return os.read(master, 256)
+        except (BlockingIOError, OSError):
+            return b''
+    return read
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='STM32 telemetry simulator on a pseudo-terminal')
+    parser.add_argument('--cycle', choices=sorted(CYCLES), default='endurance')
+    parser.add_argument('--rate', type=float, default=100, help='samples per second')
+    parser.add_argument('--mode', choices=('binary', 'csv'), default='binary')
+    parser.add_argument('--baudrate', type=int, default=115200, help='UART speed the RATE limit is derived from')
+    parser.add_argument('--signals', metavar='FILE', help='signal definitions, signals.json by default')
+    parser.add_argument('--duration', type=float, help='seconds to run, until Ctrl-C by default')
+    parser.add_argument('--noise', type=float, default=0.0, help='fraction of frames with a flipped bit')
+    parser.add_argument('--dropout-every', type=float, default=0.0, metavar='S', help='silence the link every S seconds')
+    parser.add_argument('--dropout-for', type=float, default=0.5, metavar='S', help='length of each dropout')
+    parser.add_argument('--sequence', action='store_true', help='send the frame number in the speed field')
+    parser.add_argument('--seed', type=int, help='random seed for noise')
+    parser.add_argument('--link', metavar='PATH', help='also make the port available as PATH')
+    parser.add_argument('--log', metavar='FILE', help='CSV of every frame and what became of it')
+    parser.add_argument('--report', metavar='FILE', help='write the summary as JSON to FILE')
+    args = parser.parse_args()
+
+    signals = load_signals(args.signals)
+    log_file = open(args.log, 'w', newline='') if args.log else None
+    log = None
+    if log_file:
+        log = csv.writer(log_file)
+        log.writerow(('frame', 't', 'status') + signals.names)
+    simulator = Simulator(args.cycle, args.rate, args.mode, signals, args.noise, args.dropout_every,
+                          args.dropout_for, args.sequence, args.seed, log, args.baudrate)
+    master, slave, path = open_pty(args.link)
+    print(f"Simulating {args.cycle} at {args.rate:g} Hz on {args.link or path}", flush=True)
+    try:
+        simulator.run(pty_writer(master), args.duration, read=pty_reader(master))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log_file:
+            log_file.close()
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+    report = simulator.report()
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,476 @@
+import heapq
+import json
+import os
+import selectors
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import deque
+
+from protocol import make_parser
+from signals import load_signals
+
+
+# USB VID/PID pairs of the STM32 boards: virtual COM port and ST-LINK VCP
+STM32_USB_IDS = ((0x0483, 0x5740), (0x0483, 0x374B), (0x0483, 0x374E), (0x0483, 0x3752))
+
+
+class TelemetrySource(object):
+    # A source runs on its own thread and calls handler(sample) for every
+    # decoded sample, where sample is a tuple in signal database order
+    # (telemetry.CHANNELS for the default signals.json).
+    # Link state changes are reported through on_state(state), also from
+    # the source thread. An exception raised by the handler is printed and
+    # counted, it never stops the source.
+    def __init__(self):
+        self.running = False
+        self.thread = None
+        self.state = 'disconnected'
+        self.on_state = None
+        # Monotonic time the data currently being handled was received
+        self.arrival = 0.0
+        self.handler_errors = 0
+
+    def set_state(self, state):
+        if state != self.state:
+            self.state = state
+            if self.on_state:
+                self.on_state(state)
+
+    def run(self, handler):
+        raise NotImplementedError
+
+    def guard(self, handler):
+        def guarded(sample):
+            try:
+                handler(sample)
+            except Exception:
+                self.handler_errors += 1
+                # The first one in full, then once in a thousand
+                if self.handler_errors % 1000 == 1:
+                    print(f"Telemetry handler failed ({self.handler_errors} so far):")
+                    traceback.print_exc()
+        return guarded
+
+    def start(self, handler):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(self.guard(handler),), name=type(self).__name__)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def counters(self):
+        return {'state': self.state, 'handler_errors': self.handler_errors}
+
+
+def find_port(usb_ids=STM32_USB_IDS):
+    from serial.tools import list_ports
+    for info in list_ports.comports():
+        if (info.vid, info.pid) in usb_ids:
+            return info.device
+    return None
+
+
+class SerialSource(TelemetrySource):
+    # Reads whatever the OS has buffered in one syscall whenever the port
+    # becomes readable. Any error closes the port and the source keeps
+    # trying to reopen it, with exponential backoff from backoff_min to
+    # backoff_max seconds. With no fixed port the STM32 is looked up by
+    # USB VID/PID on every attempt, so a re-enumerated device is found.
+    # Frames are decoded with the given signal database, or the built in
+    # layout when there is none. The MCU's command acknowledgements go to
+    # on_control(text), from the source thread.
+    def __init__(self, port=None, baudrate=115200, mode='binary', read_size=4096,
+                 stale_after=1.0, backoff_min=0.05, backoff_max=2.0, signals=None):
+        super(SerialSource, self).__init__()
+        self.port = port
+        self.baudrate = baudrate
+        self.parser = signals.make_parser(mode) if signals else make_parser(mode)
+        self.on_control = None
+        if mode == 'binary':
+            self.parser.control = self.handle_control
+        self.read_size = read_size
+        self.stale_after = stale_after
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self.connects = 0
+        self.bytes_read = 0
+        self.reads = 0
+        self.last_error = None
+        # Descriptor of the open port, for commands to the MCU
+        self.fd = None
+
+    def counters(self):
+        return {
+            'state': self.state,
+            'connects': self.connects,
+            'reads': self.reads,
+            'bytes': self.bytes_read,
+            'frames': self.parser.frames,
+            'bad_frames': self.parser.bad_frames,
+            'dropped_bytes': self.parser.dropped_bytes,
+            'controls': getattr(self.parser, 'controls', 0),
+            'handler_errors': self.handler_errors,
+        }
+
+    def open_port(self):
+        import serial
+        port = self.port or find_port()
+        if port is None:
+            if not os.path.exists('/dev/ttyACM0'):
+                return None
+            port = '/dev/ttyACM0'
+        return serial.Serial(port, self.baudrate, timeout=0)
+
+    def run(self, handler):
+        import serial
+        delay = self.backoff_min
+        try:
+            while self.running:
+                try:
+                    serial_port = self.open_port()
+                except (serial.SerialException, OSError) as e:
+                    serial_port = None
+                    self.last_error = str(e)
+                if serial_port is None:
+                    self.set_state('reconnecting' if self.connects else 'searching')
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.backoff_max)
+                    continue
+
+                delay = self.backoff_min
+                self.connects += 1
+                self.set_state('connected')
+                try:
+                    self.read_port(serial_port, handler)
+                except (serial.SerialException, OSError) as e:
+                    self.last_error = str(e)
+                    print(f"Serial link lost: {e}")
+                except Exception as e:
+                    # A decoder bug, treated like a link error: the port is
+                    # reopened and the parser starts from a clean buffer
+                    self.last_error = repr(e)
+                    traceback.print_exc()
+                    self.parser.reset()
+                finally:
+                    self.fd = None
+                    serial_port.close()
+                if self.running:
+                    self.set_state('reconnecting')
+        finally:
+            self.set_state('disconnected')
+
+    def handle_control(self, text):
+        if self.on_control:
+            self.on_control(text)
+
+    def send(self, data):
+        # Writes to the MCU from any thread; False when the link is down
+        fd = self.fd
+        if fd is None:
+            return False
+        try:
+            return os.write(fd, data) == len(data)
+        except OSError:
+            return False
+
+    def read_port(self, serial_port, handler):
+        import serial
+        fd = serial_port.fileno()
+        feed = self.parser.feed
+        last_data = time.monotonic()
+        self.fd = fd
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while self.running:
+                if not selector.select(self.stale_after / 4):
+                    if time.monotonic() - last_data > self.stale_after:
+                        self.set_state('stale')
+                    continue
+                data = os.read(fd, self.read_size)
+                if not data:
+                    # Readable but empty means the device went away
+                    raise serial.SerialException('device disconnected')
+                last_data = self.arrival = time.monotonic()
+                self.reads += 1
+                self.bytes_read += len(data)
+                if self.state != 'connected':
+                    self.set_state('connected')
+                feed(data, handler)
+
+
+class SyntheticSource(TelemetrySource):
+    # Ramping dummy data, rate in samples per second (0 for as fast as possible)
+    def __init__(self, rate=10):
+        super(SyntheticSource, self).__init__()
+        self.rate = rate
+        self.soc = 100
+        self.speed = 0
+        self.rpm = 0
+        self.cell_temp = 30
+
+    def sample(self):
+        self.soc -= 0.1
+        if self.soc < 0:
+            self.soc = 100
+
+        self.speed += 1
+        if self.speed > 300:
+            self.speed = 0
+
+        self.rpm += 100
+        if self.rpm > 10000:
+            self.rpm = 0
+
+        power = (self.speed / 300) * 100
+        current = (self.speed / 300) * 100
+        return (self.speed, self.rpm, power, current, self.soc, self.cell_temp, 0)
+
+    def run(self, handler):
+        interval = 1.0 / self.rate if self.rate else 0
+        deadline = time.monotonic()
+        self.set_state('connected')
+        while self.running:
+            self.arrival = time.monotonic()
+            handler(self.sample())
+            if interval:
+                deadline += interval
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        self.set_state('disconnected')
+
+
+class ReplaySource(TelemetrySource):
+    # Streams a recorded session with its original timing scaled by speed
+    # (2 plays twice as fast, 0 as fast as possible). seek() jumps to a
+    # position in seconds from the start of the session, also while playing.
+    def __init__(self, session, speed=1.0, start=0, loop=False):
+        super(ReplaySource, self).__init__()
+        from recorder import Segment, session_segments
+        self.segments = [Segment(path) for path in session_segments(session)]
+        self.segments = [segment for segment in self.segments if segment.count]
+        if not self.segments:
+            raise ValueError("Nothing recorded in %s" % session)
+        self.speed = speed
+        self.loop = loop
+        self.origin = self.segments[0].times[0]
+        self.duration = self.segments[-1].times[-1] - self.origin
+        self.position = 0
+        self._seek = start
+
+    def seek(self, seconds):
+        self._seek = seconds
+
+    def _locate(self, seconds):
+        t = self.origin + seconds
+        for i, segment in enumerate(self.segments):
+            if segment.times[-1] >= t:
+                return i, bisect_left(segment.times, t)
+        return len(self.segments), 0
+
+    def run(self, handler):
+        self.set_state('connected')
+        while self.running:
+            index, row = self._locate(self._seek)
+            self._seek = None
+            base = None
+            while self.running and self._seek is None and index < len(self.segments):
+                segment = self.segments[index]
+                times = segment.times
+                columns = segment.columns
+                while row < segment.count:
+                    t = times[row]
+                    if self.speed:
+                        now = time.monotonic()
+                        if base is None:
+                            base = (t, now)
+                        delay = (t - base[0]) / self.speed - (now - base[1])
+                        if delay > 0:
+                            time.sleep(delay)
+                    if not self.running or self._seek is not None:
+                        break
+                    self.position = t - self.origin
+                    self.arrival = time.monotonic()
+                    handler(tuple(column[row] for column in columns))
+                    row += 1
+                else:
+                    index += 1
+                    row = 0
+            if self._seek is None:
+                if not self.loop:
+                    break
+                self._seek = 0
+        self.running = False
+        self.set_state('disconnected')
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+# Best link state of the merged ports wins
+STATE_ORDER = ('connected', 'stale', 'reconnecting', 'searching', 'disconnected')
+
+
+class MergedSource(TelemetrySource):
+    # Several sources read concurrently, each on its own thread and with
+    # its own signal database, merged into one stream ordered by arrival
+    # time. A port's samples are only held back until every other port has
+    # something newer queued, or for at most `latency` seconds, so a quiet
+    # port never stalls the others. Each port fills in its own channels of
+    # the combined sample; the rest keep their last value.
+    def __init__(self, ports, channels, latency=0.02):
+        super(MergedSource, self).__init__()
+        self.channels = tuple(channels)
+        self.latency = latency
+        index = dict((name, i) for i, name in enumerate(self.channels))
+        self.ports = []
+        for name, source, port_channels in ports:
+            # (position in the combined sample, position in the port sample)
+            mapping = [(index[c], i) for i, c in enumerate(port_channels) if c in index]
+            self.ports.append((name, source, mapping, deque()))
+        self.merged = 0
+        self.late = 0
+        self.last_time = 0.0
+        self.counts = [0] * len(self.ports)
+
+    def start(self, handler):
+        for i, (name, source, mapping, queue) in enumerate(self.ports):
+            source.on_state = self.update_state
+            source.start(self._port_handler(source, queue))
+        super(MergedSource, self).start(handler)
+
+    def _port_handler(self, source, queue):
+        append = queue.append
+
+        def handler(sample):
+            append((source.arrival, sample))
+        return handler
+
+    def update_state(self, state):
+        states = [source.state for name, source, mapping, queue in self.ports]
+        self.set_state(min(states, key=STATE_ORDER.index))
+
+    def run(self, handler):
+        ports = self.ports
+        values = [0] * len(self.channels)
+        heap = []
+        pending = [False] * len(ports)
+        while self.running:
+            emitted = False
+            while True:
+                # Head of every port queue that is not in the heap yet
+                for i, (name, source, mapping, queue) in enumerate(ports):
+                    if not pending[i] and queue:
+                        t, sample = queue.popleft()
+                        heapq.heappush(heap, (t, i, sample))
+                        pending[i] = True
+                if not heap:
+                    break
+                t = heap[0][0]
+                if not all(pending) and t > time.monotonic() - self.latency:
+                    break
+                t, i, sample = heapq.heappop(heap)
+                pending[i] = False
+                if t < self.last_time:
+                    # Held back longer than the latency bound allows
+                    self.late += 1
+                else:
+                    self.last_time = t
+                for target, position in ports[i][2]:
+                    values[target] = sample[position]
+                self.arrival = t
+                self.merged += 1
+                self.counts[i] += 1
+                handler(tuple(values))
+                emitted = True
+            if not emitted:
+                time.sleep(self.latency / 4)
+        for name, source, mapping, queue in ports:
+            source.stop()
+        self.set_state('disconnected')
+
+    def stop(self):
+        super(MergedSource, self).stop()
+        for name, source, mapping, queue in self.ports:
+            source.stop()
+
+    def counters(self):
+        data = {'state': self.state, 'merged': self.merged, 'late': self.late, 'ports': {}}
+        for (name, source, mapping, queue), count in zip(self.ports, self.counts):
+            port = source.counters()
+            port['queued'] = len(queue)
+            port['merged'] = count
+            data['ports'][name] = port
+        return data
+
+
+def load_ports(path, channels):
+    # Port list for MergedSource, e.g.
+    #   {"latency": 0.02, "ports": [
+    #     {"name": "vcu", "port": "/dev/ttyACM0"},
+    #     {"name": "bms", "port": "/dev/ttyUSB0", "mode": "csv", "signals": "bms.json"}]}
+    # Signal files are relative to the port list
+    with open(path) as f:
+        spec = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    ports = []
+    for entry in spec['ports']:
+        signals = load_signals(os.path.join(base, entry['signals']) if 'signals' in entry else None)
+        source = SerialSource(entry.get('port'), entry.get('baudrate', 115200), entry.get('mode', 'binary'),
+                              signals=signals)
+        ports.append((entry.get('name', entry.get('port')), source, signals.names))
+    return MergedSource(ports, channels, spec.get('latency', 0.02))
+
+
+def make_source(args):
+    if args.source == 'serial':
+        return SerialSource(args.port, args.baudrate, args.mode, signals=load_signals(args.signals))
+    if args.source == 'synthetic':
+        return SyntheticSource(args.rate)
+    if args.source == 'replay':
+        return ReplaySource(args.replay, args.speed, args.seek, args.loop)
+    if args.source == 'shared':
+        from acquisition import SharedMemorySource
+        return SharedMemorySource(args.attach)
+    if args.source == 'multi':
+        return load_ports(args.ports, load_signals(args.signals).names)
+    raise ValueError("Unknown source: %s" % args.source)
+
+
+def add_source_arguments(parser):
+    parser.add_argument('--source', choices=('serial', 'synthetic', 'replay', 'shared', 'multi'), default='serial',
+                        help="'shared' attaches to a running daemon.py, 'multi' reads every port in --ports")
+    parser.add_argument('--port', help='serial device, found by STM32 USB VID/PID when omitted')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--mode', choices=('binary', 'csv'), default='binary',
+                        help="'binary' for framed telemetry, 'csv' for comma separated lines")
+    parser.add_argument('--signals', metavar='FILE', help='signal definitions, signals.json by default')
+    parser.add_argument('--ports', metavar='FILE', default='ports.json', help='serial ports to merge for --source multi')
+    parser.add_argument('--rate', type=float, default=10, help='synthetic samples per second, 0 for unlimited')
+    parser.add_argument('--replay', metavar='SESSION', help='recorded session directory to replay')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, 0 for as fast as possible')
+    parser.add_argument('--seek', type=float, default=0, help='replay start position in seconds')
+    parser.add_argument('--loop', action='store_true', help='restart the replay when it ends')
+    parser.add_argument('--attach', metavar='NAME', default='driverinterface',
+                        help='shared memory ring of the ingest daemon')
+    return parser
+
+
+def source_arguments(args):
+    # The command line add_source_arguments parses back into args, for
+    # running the same source in another process
+    argv = ['--source', args.source, '--baudrate', str(args.baudrate), '--mode', args.mode,
+            '--rate', str(args.rate), '--speed', str(args.speed), '--seek', str(args.seek)]
+    for flag, value in (('--port', args.port), ('--signals', args.signals), ('--replay', args.replay),
+                        ('--attach', args.attach), ('--ports', os.path.abspath(args.ports))):
+        if value:
+            argv += [flag, value]
+    if args.loop:
+        argv.append('--loop')
+    return argv
@@ -0,0 +1,33 @@
+import threading
+
+CHANNELS = ('speed', 'rpm', 'power', 'current', 'soc', 'cell_temp', 'error')
+
+
+class TelemetryStore(object):
+    # Latest value per channel, written by the reader thread and read once
+    # per frame by the UI. The whole state is one tuple that gets replaced
+    # on every write, so readers never need the lock and never see a
+    # half-updated sample. The lock only serialises concurrent writers.
+    def __init__(self, channels=CHANNELS):
+        self.channels = tuple(channels)
+        self.index = dict((name, i) for i, name in enumerate(self.channels))
+        n = len(self.channels)
+        # (sequence, values, per-channel sequence of the last change)
+        self._state = (0, (0,) * n, (0,) * n)
+        self._write_lock = threading.Lock()
+        # (arrival, parsed) monotonic times of the latest sample, set by
+        # the ingest pipeline for latency metrics
+        self.stamp = (0.0, 0.0)
+
+    def publish(self, sample):
+        # Only channels whose value changed get the new sequence number, so
+        # readers can skip the ones they have already drawn
+        sample = tuple(sample)
+        with self._write_lock:
+            seq, values, seqs = self._state
+            seq += 1
+            self._state = (seq, sample, tuple(seq if new != old else last
+                                               for new, old, last in zip(sample, values, seqs)))
+
+    def snapshot(self):
+        return self._state
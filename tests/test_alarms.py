@@ -0,0 +1,78 @@
+import pytest
+
+from alarms import AlarmEngine
+
+CHANNELS = ('soc', 'cell_temp', 'error')
+
+
+def engine(*rules):
+    changes = []
+    return AlarmEngine(list(rules), CHANNELS, changes.append), changes
+
+
+def run(alarms, samples):
+    for t, sample in samples:
+        alarms.evaluate(t, sample)
+
+
+def test_below_with_hysteresis():
+    alarms, changes = engine({'name': 'soc_low', 'channel': 'soc', 'kind': 'below', 'threshold': 50, 'clear': 52})
+    run(alarms, [(0.0, (51, 0, 0)), (1.0, (50, 0, 0))])
+    assert changes == []
+    run(alarms, [(2.0, (49.9, 0, 0))])
+    assert [c.active for c in changes] == [True]
+    # Between threshold and clear level it stays raised
+    run(alarms, [(3.0, (51, 0, 0)), (4.0, (51.9, 0, 0)), (5.0, (49, 0, 0))])
+    assert [c.active for c in changes] == [True]
+    run(alarms, [(6.0, (52, 0, 0))])
+    assert [c.active for c in changes] == [True, False]
+    assert alarms.active == {}
+
+
+def test_debounce_raises_only_after_the_condition_held():
+    alarms, changes = engine({'name': 'hot', 'channel': 'cell_temp', 'kind': 'above', 'threshold': 55,
+                              'clear': 52, 'debounce': 0.5})
+    run(alarms, [(0.0, (0, 56, 0)), (0.49, (0, 56, 0))])
+    assert changes == []
+    run(alarms, [(0.5, (0, 56, 0))])
+    assert len(changes) == 1 and changes[0].active and changes[0].t == 0.5
+
+
+def test_debounce_restarts_after_a_blip():
+    alarms, changes = engine({'name': 'hot', 'channel': 'cell_temp', 'kind': 'above', 'threshold': 55,
+                              'clear': 52, 'debounce': 0.5})
+    run(alarms, [(0.0, (0, 56, 0)), (0.3, (0, 54, 0)), (0.6, (0, 56, 0)), (1.0, (0, 56, 0))])
+    assert changes == []
+    run(alarms, [(1.1, (0, 56, 0))])
+    assert [c.active for c in changes] == [True]
+    # Clearing is debounced the same way
+    run(alarms, [(2.0, (0, 51, 0)), (2.2, (0, 53, 0)), (2.4, (0, 51, 0)), (2.8, (0, 51, 0))])
+    assert [c.active for c in changes] == [True]
+    run(alarms, [(2.9, (0, 51, 0))])
+    assert [c.active for c in changes] == [True, False]
+
+
+def test_rate_alarm_uses_smoothed_rate():
+    alarms, changes = engine({'name': 'rise', 'channel': 'cell_temp', 'kind': 'rate_above', 'threshold': 1.0,
+                              'clear': 0.5, 'window': 1.0})
+    run(alarms, [(t * 0.1, (0, 30 + t * 0.2, 0)) for t in range(20)])
+    assert [c.active for c in changes] == [True]
+    run(alarms, [(2.0 + t * 0.1, (0, 34, 0)) for t in range(20)])
+    assert [c.active for c in changes] == [True, False]
+
+
+def test_code_change_while_active_raises_again():
+    alarms, changes = engine({'name': 'mcu', 'channel': 'error', 'kind': 'code', 'severity': 'critical',
+                              'message': 'Error E%d', 'codes': {'3': 'E3 Overtemperature'}})
+    run(alarms, [(0.0, (0, 0, 0)), (1.0, (0, 0, 3)), (2.0, (0, 0, 3))])
+    assert [c.message for c in changes] == ['E3 Overtemperature']
+    run(alarms, [(3.0, (0, 0, 5))])
+    assert [(c.active, c.message) for c in changes[1:]] == [(True, 'Error E5')]
+    assert alarms.active['mcu'].message == 'Error E5'
+    run(alarms, [(4.0, (0, 0, 0))])
+    assert (changes[-1].active, changes[-1].message) == (False, 'Error E5')
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        engine({'name': 'x', 'channel': 'soc', 'kind': 'sideways'})
@@ -0,0 +1,48 @@
+import pytest
+
+from history import HistoryBuffer
+
+CHANNELS = ('speed', 'soc')
+
+
+def filled(count, capacity=8):
+    history = HistoryBuffer(CHANNELS, capacity)
+    for i in range(count):
+        history.append(float(i), (float(i), 100.0 - i))
+    return history
+
+
+def values(segments):
+    return [value for segment in segments for value in segment]
+
+
+@pytest.mark.parametrize('count', [1, 7, 8, 9, 15, 16, 17])
+def test_newest_sample_at_every_fill_level(count):
+    history = filled(count)
+    assert history.time_window(1)[-1][-1] == count - 1
+    assert values(history.window('speed', 3)) == [float(i) for i in range(max(0, count - 3), count)]
+
+
+def test_right_after_a_wrap_there_is_no_empty_segment():
+    history = filled(16)
+    assert history.head == 0
+    segments = history.time_window(8)
+    assert all(len(segment) for segment in segments)
+    assert values(segments) == [float(i) for i in range(8, 16)]
+
+
+def test_since_and_decimate_after_a_wrap():
+    history = filled(16)
+    assert history.since(12.0) == 3
+    mins, maxs = history.decimate('speed', 8, 4)
+    assert mins == [8.0, 10.0, 12.0, 14.0]
+    assert maxs == [9.0, 11.0, 13.0, 15.0]
+
+
+def test_strip_chart_refreshes_right_after_a_wrap():
+    pytest.importorskip('kivy')
+    from widgets import StripChart
+    history = filled(16)
+    chart = StripChart(history, 'speed')
+    chart.refresh()
+    assert chart._line.points
@@ -0,0 +1,77 @@
+from protocol import MAX_CONTROL, PAYLOAD, FrameParser, encode_control, encode_frame
+
+
+def frames(n):
+    return [(float(i), 1000.0 + i, 2.5, -3.5, 80.0, 40.0, i) for i in range(n)]
+
+
+def feed(data, parser=None, chunk=None):
+    parser = parser or FrameParser()
+    samples = []
+    if chunk is None:
+        parser.feed(data, samples.append)
+    else:
+        for i in range(0, len(data), chunk):
+            parser.feed(data[i:i + chunk], samples.append)
+    return parser, samples
+
+
+def test_clean_stream_in_any_chunk_size():
+    sent = frames(20)
+    data = b''.join(encode_frame(sample) for sample in sent)
+    for chunk in (None, 1, 7, 31, 500):
+        parser, samples = feed(data, chunk=chunk)
+        assert samples == sent
+        assert parser.bad_frames == parser.dropped_bytes == 0
+
+
+def test_resync_after_crc_corruption():
+    sent = frames(5)
+    encoded = [bytearray(encode_frame(sample)) for sample in sent]
+    encoded[2][10] ^= 0x01
+    parser, samples = feed(b''.join(encoded))
+    assert samples == sent[:2] + sent[3:]
+    assert parser.bad_frames >= 1
+    assert parser.dropped_bytes == len(encoded[2])
+
+
+def test_resync_after_length_corruption():
+    sent = frames(5)
+    encoded = [bytearray(encode_frame(sample)) for sample in sent]
+    encoded[1][2] = PAYLOAD.size + 1
+    encoded[3][2] = 0
+    parser, samples = feed(b''.join(encoded), chunk=3)
+    assert samples == [sent[0], sent[2], sent[4]]
+    assert parser.dropped_bytes == len(encoded[1]) + len(encoded[3])
+
+
+def test_resync_after_garbage_and_false_sync():
+    sent = frames(3)
+    data = b'\x00\xaa\x55\x1a\xff' + encode_frame(sent[0]) + b'\xaa' + encode_frame(sent[1]) + encode_frame(sent[2])
+    parser, samples = feed(data, chunk=4)
+    assert samples == sent
+
+
+def test_truncated_frame_is_dropped_not_waited_for():
+    sent = frames(3)
+    data = encode_frame(sent[0]) + encode_frame(sent[1])[:15] + encode_frame(sent[2])
+    parser, samples = feed(data)
+    assert samples == [sent[0], sent[2]]
+
+
+
+def test_pending_control_frame_survives_a_full_chunk():
+    # A control frame of MAX_CONTROL bytes is held until its CRC arrives;
+    # the largest chunk feed() passes on must still fit next to it
+    sent = frames(40)
+    text = b'X' * MAX_CONTROL
+    control = encode_control(text)
+    parser = FrameParser(buffer_size=256)
+    controls, samples = [], []
+    parser.control = controls.append
+    parser.feed(control[:-2], samples.append)
+    assert parser.end - parser.start == len(control) - 2
+    parser.feed(control[-2:] + b''.join(encode_frame(sample) for sample in sent), samples.append)
+    assert controls == [text]
+    assert samples == sent
+    assert parser.dropped_bytes == 0
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+from publisher import TelemetryPublisher, TelemetrySubscriber
+
+CHANNELS = ('speed', 'rpm', 'soc')
+
+
+@pytest.fixture
+def link():
+    publisher = TelemetryPublisher(CHANNELS, port=0, host='127.0.0.1', batch_size=16, flush_interval=0.01)
+    subscriber = TelemetrySubscriber('127.0.0.1', publisher.address[1], timeout=0.2)
+    yield publisher, subscriber
+    subscriber.close()
+    publisher.close()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def collect(subscriber, n, timeout=2.0):
+    received = []
+    deadline = time.monotonic() + timeout
+    while len(received) < n and time.monotonic() < deadline:
+        received.extend(subscriber.receive())
+    return received
+
+
+def test_loopback_delivers_every_sample_in_order(link):
+    publisher, subscriber = link
+    subscriber.subscribe()
+    assert wait_for(lambda: publisher.subscribers)
+
+    sent = [(float(i), (float(i), 100.0 * i, 50.5)) for i in range(100)]
+    for t, sample in sent:
+        publisher.publish(t, sample)
+
+    received = collect(subscriber, len(sent))
+
+    assert subscriber.channels == CHANNELS
+    assert subscriber.lost == 0
+    assert [t for t, _ in received] == [t for t, _ in sent]
+    # Values travel as float32
+    assert [values for _, values in received] == [pytest.approx(sample) for _, sample in sent]
+
+
+def test_unsubscribe_stops_delivery(link):
+    publisher, subscriber = link
+    subscriber.subscribe()
+    assert wait_for(lambda: publisher.subscribers)
+    subscriber.close()
+    assert wait_for(lambda: not publisher.subscribers)
+    publisher.publish(0.0, (1.0, 2.0, 3.0))
+    assert publisher.samples == 0
+
+
+@pytest.fixture
+def stopped():
+    # A publisher whose sender thread is stopped, driven step by step
+    publisher = TelemetryPublisher(CHANNELS, port=0, host='127.0.0.1', queue_size=4)
+    publisher._running = False
+    publisher._thread.join(1)
+    subscriber = TelemetrySubscriber('127.0.0.1', publisher.address[1], timeout=0.2)
+    yield publisher, subscriber
+    subscriber.sock.close()
+    publisher.sock.close()
+
+
+def accept(publisher):
+    assert wait_for(lambda: publisher._receive() or publisher.subscribers)
+    return next(iter(publisher.subscribers.values()))
+
+
+def test_full_queue_drops_oldest_and_keeps_description(stopped):
+    publisher, subscriber = stopped
+    subscriber.subscribe()
+    entry = accept(publisher)
+    datagrams = [publisher._pack([(float(i), (float(i), 0.0, 0.0))]) for i in range(6)]
+    for datagram in datagrams:
+        publisher._queue(datagram)
+    assert list(entry.queue) == datagrams[2:]
+    assert entry.dropped == publisher.dropped == 2
+    assert entry.describe
+
+    assert publisher._send(entry)
+    received = collect(subscriber, 4)
+    assert subscriber.channels == CHANNELS
+    assert [t for t, _ in received] == [2.0, 3.0, 4.0, 5.0]
+    assert publisher.counters()['dropped'] == 2
+
+
+def test_lost_description_is_sent_again(stopped):
+    publisher, subscriber = stopped
+    subscriber.subscribe()
+    entry = accept(publisher)
+    # The DESC datagram went out and was lost on the way
+    entry.describe = False
+    publisher._queue(publisher._pack([(1.0, (1.0, 2.0, 3.0))]))
+    publisher._send(entry)
+    subscriber.renewed = 0.0
+    assert subscriber.receive() == []
+    assert subscriber.channels is None
+
+    # The client asked again when DATA came without a layout
+    assert wait_for(lambda: publisher._receive() or entry.describe)
+    publisher._queue(publisher._pack([(2.0, (4.0, 5.0, 6.0))]))
+    publisher._send(entry)
+    received = collect(subscriber, 1)
+    assert subscriber.channels == CHANNELS
+    assert received == [(2.0, (4.0, 5.0, 6.0))]
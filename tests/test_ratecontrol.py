@@ -0,0 +1,203 @@
+import threading
+import time
+
+import pytest
+
+from protocol import FrameParser, decode_command, encode_command, encode_control, encode_frame, max_frame_rate
+from ratecontrol import RateController
+from signals import load_signals
+from simulator import Simulator
+
+
+class LoopbackSource(object):
+    # Stands in for SerialSource: commands go straight to a simulator and
+    # its acknowledgements come back through a frame parser
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.baudrate = 115200
+        self.parser = FrameParser()
+        self.parser.control = lambda text: self.on_control(text)
+        self.on_control = None
+        self.dropped_bytes = 0
+        self.lines = []
+
+    def send(self, data):
+        self.lines.append(data)
+        self.simulator.receive(data)
+        self.parser.feed(b''.join(self.simulator.replies), lambda sample: None)
+        del self.simulator.replies[:]
+        return True
+
+    def counters(self):
+        return {'dropped_bytes': self.dropped_bytes}
+
+
+def controller(**kwargs):
+    simulator = Simulator(rate=10)
+    source = LoopbackSource(simulator)
+    return RateController(source, load_signals(), **kwargs), source, simulator
+
+
+def test_command_checksum_round_trip():
+    line = encode_command(b'RATE 150')
+    assert line == b'RATE 150*5D93\n'
+    assert decode_command(line) == b'RATE 150'
+    assert decode_command(b'RATE 151*5D93\n') is None
+    assert decode_command(b'RATE 150\n') is None
+
+
+def test_control_frames_between_telemetry_frames():
+    sample = (1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7)
+    data = encode_frame(sample) + encode_control(b'RATE 150') + encode_frame(sample) + encode_control(b'DIV 5 10')
+    parser = FrameParser()
+    controls, samples = [], []
+    parser.control = controls.append
+    parser.feed(data, samples.append)
+    assert samples == [sample, sample]
+    assert controls == [b'RATE 150', b'DIV 5 10']
+    assert parser.dropped_bytes == 0
+
+
+def test_simulator_rejects_bad_checksums_and_acknowledges_the_rest():
+    simulator = Simulator(rate=10)
+    simulator.receive(b'RATE 150*0000\n' + encode_command(b'RATE 120') + encode_command(b'RATE 5000'))
+    assert simulator.rate == 120
+    assert simulator.rejected == 1
+    assert simulator.replies == [encode_control(b'RATE 120')]
+
+
+def test_max_rate_follows_the_baud_rate():
+    rc, source, simulator = controller()
+    assert rc.max_rate == max_frame_rate(115200) == 371
+    assert simulator.max_rate == 371
+
+
+def test_rate_climbs_only_from_a_confirmed_rate():
+    rc, source, simulator = controller()
+    rc.step(now=100.0)
+    assert rc.confirmed == rc.rate == simulator.rate == 10
+    rc.step(now=101.0)
+    assert rc.reason == 'headroom'
+    assert rc.confirmed == rc.rate == simulator.rate > 10
+
+    # An MCU that stops acknowledging holds the rate where it is
+    simulator.receive = lambda data: None
+    confirmed = rc.rate
+    rc.step(now=102.0)
+    climbed = rc.rate
+    assert climbed > confirmed
+    rc.step(now=103.0)
+    rc.step(now=104.0)
+    assert rc.reason == 'unconfirmed'
+    assert rc.rate == climbed
+    assert rc.confirmed == simulator.rate == confirmed
+
+
+def test_unacknowledged_commands_are_resent():
+    rc, source, simulator = controller()
+    rc.step(now=100.0)
+    sent = len(source.lines)
+    rc.step(now=101.0)
+    # Only what changed goes out again once acknowledged
+    assert len(source.lines) - sent < sent
+    simulator.receive = lambda data: None
+    before = len(source.lines)
+    rc.step(now=102.0)
+    unacked = source.lines[before:]
+    assert unacked
+    rc.step(now=103.0)
+    assert source.lines[before + len(unacked):] == unacked
+
+
+def test_loss_backs_off_then_holds():
+    rc, source, simulator = controller(holdoff=2.0)
+    for i in range(10):
+        rc.step(now=100.0 + i)
+    rate = rc.rate
+    source.dropped_bytes += 10
+    rc.step(now=110.0)
+    assert rc.reason == 'loss'
+    assert rc.rate == int(rate * 0.7)
+    rc.step(now=111.0)
+    assert rc.reason == 'holdoff'
+    assert rc.rate == int(rate * 0.7)
+    rc.step(now=112.5)
+    assert rc.reason == 'headroom'
+    assert rc.rate > int(rate * 0.7)
+
+
+def test_rate_control_against_simulator_pty():
+    pytest.importorskip('serial')
+    from metrics import Metrics
+    from pipeline import IngestPipeline
+    from simulator import open_pty, pty_reader, pty_writer
+    from sources import SerialSource
+    from telemetry import TelemetryStore
+
+    master, slave, path = open_pty()
+    simulator = Simulator(rate=10, seed=1)
+    stop = threading.Event()
+    thread = threading.Thread(target=simulator.run, args=(pty_writer(master),),
+                              kwargs={'running': lambda: not stop.is_set(), 'read': pty_reader(master)})
+    thread.start()
+    signals = load_signals()
+    metrics = Metrics()
+    source = SerialSource(path, signals=signals)
+    pipeline = IngestPipeline(TelemetryStore(), source=source, metrics=metrics)
+    rc = RateController(source, signals, metrics, interval=0.2)
+    source.start(pipeline.update)
+    try:
+        time.sleep(0.3)
+        for _ in range(15):
+            rc.step()
+            time.sleep(0.2)
+        counters = source.counters()
+        assert rc.confirmed == simulator.rate > 10
+        assert rc.acks > 0
+        assert counters['dropped_bytes'] == 0
+        assert simulator.report()['rejected_commands'] == 0
+    finally:
+        stop.set()
+        source.stop()
+        thread.join()
+
+
+def present(metrics, t, draw):
+    metrics.drawing(t - draw)
+    metrics.presented(t)
+
+
+def test_idle_dashboard_is_headroom():
+    from metrics import Metrics
+    metrics = Metrics()
+    rc, source, simulator = controller(metrics=metrics)
+    rc.step(now=100.0)
+    # Nothing moves: a frame every 100 ms at most, each quick to draw
+    for i in range(10):
+        present(metrics, 100.1 + i * 0.1, 0.002)
+    rc.step(now=101.0)
+    assert rc.reason == 'headroom'
+    assert rc.rate > 10
+
+
+def test_slow_drawing_backs_off():
+    from metrics import Metrics
+    metrics = Metrics()
+    rc, source, simulator = controller(metrics=metrics)
+    for i in range(5):
+        rc.step(now=100.0 + i)
+    rate = rc.rate
+    for i in range(10):
+        present(metrics, 105.0 + i * 0.05, 0.045)
+    rc.step(now=105.5)
+    assert rc.reason == 'draw time'
+    assert rc.rate == int(rate * 0.7)
+
+
+def test_simulator_rejects_out_of_range_channels_like_the_firmware():
+    simulator = Simulator(rate=10)
+    channels = len(simulator.divisors)
+    simulator.receive(encode_command(b'DIV -1 5') + encode_command(b'DIV %d 5' % channels) +
+                      encode_command(b'DIV 2 0') + encode_command(b'DIV %d 5' % (channels - 1)))
+    assert simulator.divisors == [1] * (channels - 1) + [5]
+    assert simulator.replies == [encode_control(b'DIV %d 5' % (channels - 1))]
@@ -0,0 +1,38 @@
+import pytest
+
+from signals import Signal, SignalDatabase, load_signals
+
+
+def scaled_database():
+    return SignalDatabase([
+        Signal('voltage', 'f', offset=0, index=0, scale=0.1),
+        Signal('temp', 'H', offset=4, index=1, bias=-40),
+    ])
+
+
+def decode(db, mode, data):
+    samples = []
+    db.make_parser(mode).feed(data, samples.append)
+    return samples
+
+
+def test_csv_round_trip_applies_scale_and_bias():
+    db = scaled_database()
+    samples = decode(db, 'csv', db.encode_line((12.3, 5)))
+    assert len(samples) == 1
+    assert samples[0][0] == pytest.approx(12.3)
+    assert samples[0][1] == 5
+
+
+def test_binary_round_trip_applies_scale_and_bias():
+    db = scaled_database()
+    samples = decode(db, 'binary', db.encode_frame((12.3, 5)))
+    assert samples[0][0] == pytest.approx(12.3)
+    assert samples[0][1] == 5
+
+
+def test_default_database_round_trip():
+    db = load_signals()
+    sample = (123.5, 4000.0, 30.25, 12.5, 87.5, 41.0, 3)
+    for mode, encode in (('binary', db.encode_frame), ('csv', db.encode_line)):
+        assert decode(db, mode, encode(sample)) == [sample]
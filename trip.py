@@ -0,0 +1,190 @@
+import threading
+from collections import namedtuple
+
+from telemetry import CHANNELS
+
+# Finished aggregates of one horizon. Energy is the trapezoidal integral of
+# power (kW) over time, distance the same for speed (km/h); the range
+# estimate extrapolates the SOC used per km over the remaining SOC.
+TripStats = namedtuple('TripStats', (
+    'seconds', 'samples', 'temp_min', 'temp_max', 'temp_mean', 'current_peak',
+    'energy_wh', 'distance_km', 'wh_per_km', 'soc_used', 'range_km'))
+
+INF = float('inf')
+
+
+class Accumulator(object):
+    # Running totals that merge in O(1); one per bucket and per horizon
+    __slots__ = ('start', 'end', 'samples', 'temp_sum', 'temp_min', 'temp_max',
+                 'current_peak', 'energy', 'distance', 'soc_start', 'soc_end')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = self.end = None
+        self.samples = 0
+        self.temp_sum = 0.0
+        self.temp_min = INF
+        self.temp_max = -INF
+        self.current_peak = -INF
+        self.energy = 0.0
+        self.distance = 0.0
+        self.soc_start = self.soc_end = None
+
+    def add(self, t, temp, current, soc, energy, distance):
+        if self.start is None:
+            self.start = t
+            self.soc_start = soc
+        self.end = t
+        self.soc_end = soc
+        self.samples += 1
+        self.temp_sum += temp
+        if temp < self.temp_min:
+            self.temp_min = temp
+        if temp > self.temp_max:
+            self.temp_max = temp
+        if current > self.current_peak:
+            self.current_peak = current
+        self.energy += energy
+        self.distance += distance
+
+    def merge(self, other):
+        # other must cover a later span than self
+        if not other.samples:
+            return
+        if self.start is None:
+            self.start = other.start
+            self.soc_start = other.soc_start
+        self.end = other.end
+        self.soc_end = other.soc_end
+        self.samples += other.samples
+        self.temp_sum += other.temp_sum
+        self.temp_min = min(self.temp_min, other.temp_min)
+        self.temp_max = max(self.temp_max, other.temp_max)
+        self.current_peak = max(self.current_peak, other.current_peak)
+        self.energy += other.energy
+        self.distance += other.distance
+
+    def stats(self):
+        if not self.samples:
+            return TripStats(0.0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, None)
+        energy_wh = self.energy / 3.6
+        distance_km = self.distance / 3600.0
+        soc_used = self.soc_start - self.soc_end
+        range_km = self.soc_end * distance_km / soc_used if soc_used > 0 and distance_km > 0 else None
+        return TripStats(self.end - self.start, self.samples, self.temp_min, self.temp_max,
+                         self.temp_sum / self.samples, self.current_peak, energy_wh, distance_km,
+                         energy_wh / distance_km if distance_km > 0 else 0.0, soc_used, range_km)
+
+
+class RollingWindow(object):
+    # The last `seconds` in `buckets` fixed slots, so memory does not grow
+    # with the sample rate. Samples go into the newest bucket; when it is
+    # full the older buckets are summed once, and between rotations the
+    # window is that sum plus the newest bucket. Resolution is one bucket.
+    def __init__(self, seconds, buckets=100):
+        self.seconds = seconds
+        self.width = float(seconds) / buckets
+        self.buckets = [Accumulator() for i in range(buckets)]
+        self.current = 0
+        self.bucket_end = None
+        self.older = Accumulator()
+
+    def add(self, t, *values):
+        if self.bucket_end is None:
+            self.bucket_end = t + self.width
+        elif t >= self.bucket_end:
+            self.rotate(t)
+        self.buckets[self.current].add(t, *values)
+
+    def rotate(self, t):
+        n = len(self.buckets)
+        # Empty every bucket skipped over by a gap in the data
+        steps = min(int((t - self.bucket_end) / self.width) + 1, n)
+        for i in range(steps):
+            self.current = (self.current + 1) % n
+            self.buckets[self.current].reset()
+        self.bucket_end += self.width * int((t - self.bucket_end) / self.width + 1)
+        older = self.older
+        older.reset()
+        for i in range(1, n):
+            older.merge(self.buckets[(self.current + i) % n])
+
+    def stats(self):
+        total = Accumulator()
+        total.merge(self.older)
+        total.merge(self.buckets[self.current])
+        return total.stats()
+
+
+class TripComputer(object):
+    # Trip statistics over a rolling window, the current lap and the whole
+    # session, updated on the ingest thread in O(1) per sample. Finished
+    # TripStats are published at most every `publish_interval` seconds as
+    # one dict that is replaced, never changed, so the UI reads `results`
+    # without locking.
+    def __init__(self, channels=CHANNELS, window=10.0, publish_interval=0.2):
+        index = dict((name, i) for i, name in enumerate(channels))
+        self._speed = index['speed']
+        self._power = index['power']
+        self._current = index['current']
+        self._soc = index['soc']
+        self._temp = index['cell_temp']
+        self.window_seconds = window
+        self.publish_interval = publish_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.window = RollingWindow(self.window_seconds)
+            self.lap_stats = Accumulator()
+            self.session = Accumulator()
+            self.laps = 0
+            self.last = None
+            self.published = 0.0
+            self.results = {}
+
+    def lap(self):
+        # Start a new lap; may be called from any thread
+        with self._lock:
+            self.laps += 1
+            self.lap_stats = Accumulator()
+            self._publish()
+
+    def add(self, t, sample):
+        speed = sample[self._speed]
+        power = sample[self._power]
+        with self._lock:
+            last = self.last
+            if last is None:
+                energy = distance = 0.0
+            else:
+                dt = t - last[0]
+                energy = (power + last[1]) * 0.5 * dt
+                distance = (speed + last[2]) * 0.5 * dt
+            self.last = (t, power, speed)
+            values = (sample[self._temp], sample[self._current], sample[self._soc], energy, distance)
+            self.window.add(t, *values)
+            self.lap_stats.add(t, *values)
+            self.session.add(t, *values)
+            if t - self.published >= self.publish_interval:
+                self.published = t
+                self._publish()
+
+    def _publish(self):
+        self.results = {
+            'window': self.window.stats(),
+            'lap': self.lap_stats.stats(),
+            'session': self.session.stats(),
+            'laps': self.laps,
+        }
+
+    def counters(self):
+        results = self.results
+        data = {'laps': results.get('laps', 0)}
+        for name in ('window', 'lap', 'session'):
+            if name in results:
+                data[name] = results[name]._asdict()
+        return data
@@ -21,7 +21,8 @@
 
 /* Private includes ----------------------------------------------------------*/
 /* USER CODE BEGIN Includes */
-
+#include <stdlib.h>
+#include <string.h>
 /* USER CODE END Includes */
 
 /* Private typedef -----------------------------------------------------------*/
@@ -31,7 +32,20 @@
 
 /* Private define ------------------------------------------------------------*/
 /* USER CODE BEGIN PD */
-
+/* Telemetry frame: 0xAA 0x55 | length | payload | CRC-16/CCITT-FALSE
+ * over length and payload, little endian. Payload is speed, rpm, power,
+ * current, soc, cell_temp (float) and the error code (uint16). */
+#define CHANNELS        7
+#define FLOAT_CHANNELS  6
+#define PAYLOAD_SIZE    (FLOAT_CHANNELS * 4 + 2)
+#define FRAME_SIZE      (3 + PAYLOAD_SIZE + 2)
+/* Must match huart1.Init.BaudRate. At 10 bits a byte on the wire the
+ * link carries BAUD_RATE / 10 / FRAME_SIZE frames per second (371). */
+#define BAUD_RATE       115200
+#define RATE_MIN_HZ     1
+#define RATE_MAX_HZ     (BAUD_RATE / 10 / FRAME_SIZE)
+#define COMMAND_SIZE    32
+#define RX_RING_SIZE    128  /* power of two */
 /* USER CODE END PD */
 
 /* Private macro -------------------------------------------------------------*/
@@ -43,7 +57,26 @@
 UART_HandleTypeDef huart1;
 
 /* USER CODE BEGIN PV */
-
+/* Frames per second and, per channel, how many frames a value is held
+ * before it is read again. Both are set by the host over USART1 RX. */
+static uint16_t frame_rate_hz = 10;
+/* 1000 % frame_rate_hz carried over from frame to frame, so the rate is
+ * exact on average although the tick is whole milliseconds */
+static uint16_t frame_phase;
+static uint8_t divisor[CHANNELS] = {1, 1, 1, 1, 1, 1, 1};
+static float values[FLOAT_CHANNELS];
+static uint16_t error_code;
+static uint32_t frame_count;
+
+static char command[COMMAND_SIZE];
+static uint8_t command_length;
+
+/* Bytes from the USART1 RX interrupt, taken out by the main loop */
+static uint8_t rx_byte;
+static uint8_t rx_ring[RX_RING_SIZE];
+static volatile uint16_t rx_head;
+static volatile uint16_t rx_tail;
+static volatile uint8_t rx_rearm;
 /* USER CODE END PV */
 
 /* Private function prototypes -----------------------------------------------*/
@@ -51,12 +84,43 @@ void SystemClock_Config(void);
 static void MX_GPIO_Init(void);
 static void MX_USART1_UART_Init(void);
 /* USER CODE BEGIN PFP */
-
+static void start_receive(void);
+static void poll_commands(void);
+static int check_command(char *line);
+static int run_command(char *line);
+static void send_ack(const char *text);
+static void send_frame(void);
+float read_channel(uint8_t channel);
+uint16_t read_error_code(void);
 /* USER CODE END PFP */
 
 /* Private user code ---------------------------------------------------------*/
 /* USER CODE BEGIN 0 */
-uint8_t tx_buff[]={0,1,2,3,4,5,6,7,8,9};
+static uint16_t crc16(const uint8_t *data, uint16_t length)
+{
+  uint16_t crc = 0xFFFF;
+  while (length--)
+  {
+    crc ^= (uint16_t)(*data++) << 8;
+    for (uint8_t bit = 0; bit < 8; bit++)
+    {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+/* Sensor hooks, overridden by the application */
+__weak float read_channel(uint8_t channel)
+{
+  (void)channel;
+  return 0.0f;
+}
+
+__weak uint16_t read_error_code(void)
+{
+  return 0;
+}
 /* USER CODE END 0 */
 
 /**
@@ -89,18 +153,34 @@ int main(void)
   MX_GPIO_Init();
   MX_USART1_UART_Init();
   /* USER CODE BEGIN 2 */
-
+  start_receive();
   /* USER CODE END 2 */
 
   /* Infinite loop */
   /* USER CODE BEGIN WHILE */
+  uint32_t next_frame = HAL_GetTick();
   while (1)
   {
     /* USER CODE END WHILE */
 
     /* USER CODE BEGIN 3 */
-	  HAL_UART_Transmit(&huart1, tx_buff, 10, 1000);
-	  HAL_Delay(3000);
+	  poll_commands();
+	  if ((int32_t)(HAL_GetTick() - next_frame) >= 0)
+	  {
+	    send_frame();
+	    next_frame += 1000 / frame_rate_hz;
+	    frame_phase += 1000 % frame_rate_hz;
+	    if (frame_phase >= frame_rate_hz)
+	    {
+	      frame_phase -= frame_rate_hz;
+	      next_frame++;
+	    }
+	    if ((int32_t)(HAL_GetTick() - next_frame) > 1000)
+	    {
+	      /* Fell far behind (debugger, long stall): do not burst */
+	      next_frame = HAL_GetTick();
+	    }
+	  }
   }
   /* USER CODE END 3 */
 }
@@ -197,7 +277,166 @@ static void MX_GPIO_Init(void)
 }
 
 /* USER CODE BEGIN 4 */
+/* Host commands, one ASCII line each, ending in '*' and the CRC-16 of
+ * the text before it in hex, e.g. "RATE 150*5D93":
+ *   RATE <hz>               frames per second, 1 to RATE_MAX_HZ
+ *   DIV <channel> <frames>  read the channel every <frames> frames, 1 to 255
+ * Bytes arrive by interrupt into rx_ring, so none are lost while a frame
+ * is being transmitted. A command that passes its checksum and is applied
+ * is acknowledged with a control frame, 0xAA 0x55 | text length | text |
+ * CRC, carrying the command text. The host repeats whatever it has not
+ * seen acknowledged. */
+static void start_receive(void)
+{
+  rx_rearm = (HAL_UART_Receive_IT(&huart1, &rx_byte, 1) != HAL_OK);
+}
+
+void HAL_UART_RxCpltCallback(UART_HandleTypeDef *huart)
+{
+  if (huart == &huart1)
+  {
+    uint16_t next = (rx_head + 1) & (RX_RING_SIZE - 1);
+    if (next != rx_tail)
+    {
+      rx_ring[rx_head] = rx_byte;
+      rx_head = next;
+    }
+    start_receive();
+  }
+}
 
+void HAL_UART_ErrorCallback(UART_HandleTypeDef *huart)
+{
+  if (huart == &huart1)
+  {
+    /* Overrun or noise: the line it hit fails its checksum */
+    start_receive();
+  }
+}
+
+static void poll_commands(void)
+{
+  if (rx_rearm)
+  {
+    /* The receiver was busy when the interrupt tried to restart it */
+    start_receive();
+  }
+  while (rx_tail != rx_head)
+  {
+    uint8_t byte = rx_ring[rx_tail];
+    rx_tail = (rx_tail + 1) & (RX_RING_SIZE - 1);
+    if (byte == '\n' || byte == '\r')
+    {
+      command[command_length] = '\0';
+      if (command_length && check_command(command) && run_command(command))
+      {
+        send_ack(command);
+      }
+      command_length = 0;
+    }
+    else if (command_length < COMMAND_SIZE - 1)
+    {
+      command[command_length++] = (char)byte;
+    }
+    else
+    {
+      /* Line too long, drop it */
+      command_length = 0;
+    }
+  }
+}
+
+/* Strips the checksum off a line, 0 when it does not match */
+static int check_command(char *line)
+{
+  char *star = strrchr(line, '*');
+  char *end;
+  if (star == NULL || star[1] == '\0')
+  {
+    return 0;
+  }
+  unsigned long crc = strtoul(star + 1, &end, 16);
+  if (*end != '\0' || crc != crc16((const uint8_t *)line, (uint16_t)(star - line)))
+  {
+    return 0;
+  }
+  *star = '\0';
+  return 1;
+}
+
+/* Applies a command, 0 when it is not a valid one */
+static int run_command(char *line)
+{
+  char *end;
+  if (strncmp(line, "RATE ", 5) == 0)
+  {
+    long rate = strtol(line + 5, &end, 10);
+    if (end != line + 5 && *end == '\0' && rate >= RATE_MIN_HZ && rate <= RATE_MAX_HZ)
+    {
+      frame_rate_hz = (uint16_t)rate;
+      frame_phase = 0;
+      return 1;
+    }
+  }
+  else if (strncmp(line, "DIV ", 4) == 0)
+  {
+    long channel = strtol(line + 4, &end, 10);
+    long frames = strtol(end, &end, 10);
+    if (*end == '\0' && channel >= 0 && channel < CHANNELS && frames >= 1 && frames <= 255)
+    {
+      divisor[channel] = (uint8_t)frames;
+      return 1;
+    }
+  }
+  return 0;
+}
+
+static void send_ack(const char *text)
+{
+  uint8_t frame[3 + COMMAND_SIZE + 2];
+  uint8_t length = (uint8_t)strlen(text);
+  if (length >= PAYLOAD_SIZE)
+  {
+    /* Would read as a telemetry frame; no command is that long */
+    return;
+  }
+  frame[0] = 0xAA;
+  frame[1] = 0x55;
+  frame[2] = length;
+  memcpy(&frame[3], text, length);
+  uint16_t crc = crc16(&frame[2], 1 + length);
+  frame[3 + length] = crc & 0xFF;
+  frame[4 + length] = crc >> 8;
+  HAL_UART_Transmit(&huart1, frame, 5 + length, 10);
+}
+
+static void send_frame(void)
+{
+  uint8_t frame[FRAME_SIZE];
+  for (uint8_t channel = 0; channel < FLOAT_CHANNELS; channel++)
+  {
+    if (frame_count % divisor[channel] == 0)
+    {
+      values[channel] = read_channel(channel);
+    }
+  }
+  if (frame_count % divisor[CHANNELS - 1] == 0)
+  {
+    error_code = read_error_code();
+  }
+  frame_count++;
+
+  frame[0] = 0xAA;
+  frame[1] = 0x55;
+  frame[2] = PAYLOAD_SIZE;
+  /* Cortex-M is little endian like the wire format */
+  memcpy(&frame[3], values, FLOAT_CHANNELS * 4);
+  memcpy(&frame[3 + FLOAT_CHANNELS * 4], &error_code, 2);
+  uint16_t crc = crc16(&frame[2], 1 + PAYLOAD_SIZE);
+  frame[3 + PAYLOAD_SIZE] = crc & 0xFF;
+  frame[4 + PAYLOAD_SIZE] = crc >> 8;
+  HAL_UART_Transmit(&huart1, frame, FRAME_SIZE, 10);
+}
 /* USER CODE END 4 */
 
 /**
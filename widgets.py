@@ -0,0 +1,474 @@
+from kivy.uix.label import Label
+from kivy.uix.widget import Widget
+from kivy.uix.floatlayout import FloatLayout
+from kivy.properties import NumericProperty, ObjectProperty, StringProperty, OptionProperty
+from kivy.graphics import Color, Line, Rectangle, PushMatrix, PopMatrix, Rotate, Translate, InstructionGroup
+from kivy.clock import Clock
+from kivy.core.text import Label as CoreLabel
+from math import ceil, log1p, sqrt
+import time
+
+from assets import get_texture
+from motion import NeedleFilter, FILTERS
+
+# Gauge scales map a normalised value (0..1) to a normalised sweep (0..1)
+SCALES = {
+    'linear': lambda t: t,
+    'sqrt': sqrt,
+    'log': lambda t: log1p(9 * t) / log1p(9),
+}
+SCALE_STEPS = 256
+
+# Alarm levels (see alarms.py) and what they paint
+LEVELS = ('normal', 'warning', 'critical')
+LEVEL_COLORS = {'normal': (0, 1, 0), 'warning': (1, 1, 0), 'critical': (1, 0, 0)}
+BACKDROP_COLORS = {'normal': (0, 0, 0), 'warning': (0.3, 0.3, 0), 'critical': (0.5, 0, 0)}
+# Battery level by SOC (%) when no alarm engine sets it: above 50 normal,
+# above 20 warning, else critical
+SOC_LEVELS = ((50, 'normal'), (20, 'warning'))
+
+# Characters a NumericReadout can show; anything else comes out blank
+GLYPHS = '0123456789.-'
+
+_glyph_sets = {}
+_text_textures = {}
+
+
+def soc_level(soc):
+    for above, level in SOC_LEVELS:
+        if soc > above:
+            return level
+    return 'critical'
+
+
+class Speedometer(FloatLayout):
+    value = NumericProperty(0)
+    movement = NumericProperty(-180)
+    soc = NumericProperty(36)
+
+    min_value = NumericProperty(0)
+    max_value = NumericProperty(100)
+    start_angle = NumericProperty(-180)
+    end_angle = NumericProperty(0)
+    # Name from SCALES or any callable mapping 0..1 to 0..1
+    scale = ObjectProperty('linear')
+    # How the needle moves between samples, see motion.NeedleFilter;
+    # smoothing 0 follows the measured sample interval
+    needle_filter = OptionProperty('critical', options=FILTERS)
+    smoothing = NumericProperty(0)
+
+    def __init__(self, source='speedometer.png', **kwargs):
+        super(Speedometer, self).__init__(**kwargs)
+        self.size_hint = (None, None)
+        self.size = (400, 400)
+        self.pos_hint = {'center_x': 0.3, 'center_y': 0.5}  # Adjusted for speedometer position
+
+        # Dial background and ring, built once and only moved on resize
+        with self.canvas.before:
+            Color(1, 1, 1)
+            self._background = Rectangle(texture=get_texture(source))
+            Color(0, 0.7, 1)
+            self._ring = Line(width=2)
+
+        # Needle, drawn once pointing along +x and rotated in place
+        with self.canvas:
+            PushMatrix()
+            self._translate = Translate()
+            self._rotate = Rotate(angle=self.movement)
+            Color(1, 0.2, 0)
+            self._needle = Line(width=2)
+            PopMatrix()
+
+        # Value display from the shared glyph set, wide enough for rpm
+        self.speed_label = NumericReadout(digits=5, size_hint=(None, None), size=(100, 100))
+        self.add_widget(self.speed_label)
+
+        self._filter = NeedleFilter(self.needle_filter, self.smoothing)
+        self._sample_time = None
+        self._animation = None
+
+        self._build_scale()
+        self.bind(size=self.update_canvas, pos=self.update_canvas)
+        self.bind(min_value=self._build_scale, max_value=self._build_scale,
+                  start_angle=self._build_scale, end_angle=self._build_scale, scale=self._build_scale)
+        self.bind(value=self._on_value, movement=self.draw_speedometer)
+        self.bind(needle_filter=self._reset_filter, smoothing=self._reset_filter)
+
+    def _build_scale(self, *args):
+        scale = self.scale
+        if not callable(scale):
+            scale = SCALES[scale]
+        span = self.max_value - self.min_value
+        self._inv_span = 1.0 / span if span else 0.0
+        sweep = self.end_angle - self.start_angle
+        self._angles = [self.start_angle + sweep * scale(i / SCALE_STEPS) for i in range(SCALE_STEPS + 1)]
+        self.movement = self.value_to_angle(self.value)
+
+    def value_to_angle(self, value):
+        t = (value - self.min_value) * self._inv_span
+        if t <= 0:
+            return self._angles[0]
+        if t >= 1:
+            return self._angles[-1]
+        x = t * SCALE_STEPS
+        i = int(x)
+        a = self._angles[i]
+        return a + (self._angles[i + 1] - a) * (x - i)
+
+    def _reset_filter(self, *args):
+        self._filter = NeedleFilter(self.needle_filter, self.smoothing)
+        self._filter.reset(self.value, time.monotonic())
+
+    def set_value(self, value, t=None):
+        # t is when the sample was taken, in time.monotonic() seconds
+        self._sample_time = t
+        self.value = value
+
+    def _on_value(self, instance, value):
+        now = time.monotonic()
+        t = self._sample_time if self._sample_time is not None else now
+        self._sample_time = None
+        self._filter.push(value, t)
+        if self.needle_filter == 'none':
+            self.movement = self.value_to_angle(value)
+        elif self._animation is None:
+            # Animate at the display rate until the needle settles
+            self._animation = Clock.schedule_interval(self._animate, 0)
+        self.speed_label.value = int(value)
+
+    def _animate(self, dt):
+        now = time.monotonic()
+        self.movement = self.value_to_angle(self._filter.sample(now))
+        if self._filter.settled(now, (self.max_value - self.min_value) * 0.001):
+            self._animation.cancel()
+            self._animation = None
+            self.movement = self.value_to_angle(self.value)
+
+    def update_canvas(self, *args):
+        radius = min(self.width, self.height) / 2 - 1
+        self._background.pos = self.pos
+        self._background.size = self.size
+        self._ring.circle = (self.center_x, self.center_y, radius)
+        self._translate.xy = self.center
+        self._needle.points = [0, 0, radius * 0.8, 0]
+        self.speed_label.pos = (self.center_x - 10, self.center_y - 30)
+        self.draw_speedometer()
+
+    def draw_speedometer(self, *args):
+        self._rotate.angle = self.movement
+
+
+class BatteryIndicator(FloatLayout):
+    # The fill colour follows `level`, which the alarm engine sets; left
+    # at None (no engine) it follows the SOC thresholds in SOC_LEVELS
+    soc = NumericProperty(100)
+    level = OptionProperty(None, options=LEVELS, allownone=True)
+
+    def __init__(self, **kwargs):
+        super(BatteryIndicator, self).__init__(**kwargs)
+        self.size_hint = (None, None)
+        self.size = (100, 150)
+        self.pos_hint = {'x': 0.05, 'top': 0.95}
+
+        with self.canvas:
+            # Outline, terminal and body only change on resize
+            self._static = InstructionGroup()
+            self._level_color = Color(0, 1, 0)
+            self._level = Rectangle()
+
+        self.bind(pos=self.update_layout, size=self.update_layout, soc=self.update_battery,
+                  level=self.update_battery)
+        self.update_layout()
+
+    def update_layout(self, *args):
+        x, y = self.pos
+        terminal_height = 20
+        terminal_width = 10
+        static = self._static
+        static.clear()
+        # Battery outline and terminal
+        static.add(Color(0.5, 0.5, 0.5))
+        static.add(Rectangle(pos=self.pos, size=self.size))
+        static.add(Rectangle(pos=(x + (self.width - terminal_width) / 2, y + self.height - terminal_height + 10),
+                             size=(terminal_width, terminal_height)))
+        # Battery body
+        static.add(Color(0.2, 0.2, 0.2))  # Dark gray color
+        static.add(Rectangle(pos=(x + 5, y + 10), size=(self.width - 10, self.height - 30)))
+
+        self._level.pos = (x + 5, y + 10)
+        self.update_battery()
+
+    def update_battery(self, *args):
+        # SOC level
+        self._level.size = (self.width - 10, (self.height - 30) * (self.soc / 100.0))
+        self._level_color.rgb = LEVEL_COLORS[self.level or soc_level(self.soc)]
+
+
+class HorizontalBar(FloatLayout):
+    value = NumericProperty(0)
+    label_text = StringProperty('')
+
+    def __init__(self, **kwargs):
+        super(HorizontalBar, self).__init__(**kwargs)
+        self.size_hint = (None, None)
+        self.size = (300, 50)
+
+        with self.canvas:
+            Color(0.5, 0.5, 0.5)
+            self._track = Rectangle()
+            Color(0, 1, 0)
+            self._fill = Rectangle()
+
+        self.bind(pos=self.update_layout, size=self.update_layout, value=self.update_canvas)
+        self.update_layout()
+
+    def update_layout(self, *args):
+        self._track.pos = self.pos
+        self._track.size = self.size
+        self._fill.pos = self.pos
+        self.update_canvas()
+
+    def update_canvas(self, *args):
+        self._fill.size = (self.width * (self.value / 100.0), self.height)
+
+
+class Backdrop(object):
+    # Full screen background colour plus static artwork (the logo), drawn
+    # into the owner's canvas.before. Only the colour changes at runtime,
+    # with the alarm level.
+    def __init__(self, widget, logo='logo.png', logo_size=(200, 200), color=(0, 0, 0)):
+        self.widget = widget
+        self.logo_texture = get_texture(logo)
+        self.logo_size = logo_size
+        with widget.canvas.before:
+            self.color = Color(*color)
+            self._background = Rectangle()
+            self._static = InstructionGroup()
+        widget.bind(pos=self.update_layout, size=self.update_layout)
+        self.update_layout()
+
+    def update_layout(self, *args):
+        widget = self.widget
+        self._background.pos = widget.pos
+        self._background.size = widget.size
+        static = self._static
+        static.clear()
+        # Logo (bottom-right)
+        static.add(Color(1, 1, 1))
+        static.add(Rectangle(texture=self.logo_texture, size=self.logo_size,
+                             pos=(widget.x + widget.width * 0.95 - self.logo_size[0], widget.y)))
+
+    def set_level(self, level):
+        self.color.rgb = BACKDROP_COLORS[level]
+
+
+class StripChart(Widget):
+    # Scrolling min/max envelope of one channel from a HistoryBuffer. The
+    # line is a single persistent instruction whose points get replaced at
+    # most `refresh_interval` apart, however fast samples come in.
+    min_value = NumericProperty(0)
+    max_value = NumericProperty(100)
+    seconds = NumericProperty(120)
+
+    def __init__(self, history, channel, refresh_interval=0.2, **kwargs):
+        super(StripChart, self).__init__(**kwargs)
+        self.history = history
+        self.channel = channel
+        self.size_hint = (None, None)
+        self.size = (300, 80)
+
+        with self.canvas:
+            Color(0.15, 0.15, 0.15)
+            self._background = Rectangle()
+            Color(0, 1, 0)
+            self._line = Line(width=1)
+
+        self._trigger = Clock.create_trigger(self.refresh, refresh_interval)
+        self.bind(pos=self.update_layout, size=self.update_layout)
+        self.update_layout()
+
+    def update_layout(self, *args):
+        self._background.pos = self.pos
+        self._background.size = self.size
+        self.refresh()
+
+    def request_refresh(self, *args):
+        self._trigger()
+
+    def refresh(self, *args):
+        history = self.history
+        if not len(history):
+            return
+        t = history.time_window(1)[-1][-1]
+        n = history.since(t - self.seconds)
+        columns = max(int(self.width), 1)
+        mins, maxs = history.decimate(self.channel, n, columns)
+        span = self.max_value - self.min_value
+        scale = self.height / span if span else 0
+        x0 = self.x + self.width - len(mins)
+        low = self.min_value
+        high = self.max_value
+        points = []
+        # One vertical stroke per pixel column, from its min to its max
+        for i, (lo, hi) in enumerate(zip(mins, maxs)):
+            lo = min(max(lo, low), high)
+            hi = min(max(hi, low), high)
+            points.extend((x0 + i, self.y + (lo - low) * scale, x0 + i, self.y + (hi - low) * scale))
+        self._line.points = points
+
+
+class GlyphSet(object):
+    # GLYPHS rendered into one texture once per font size, each as a
+    # region of the same width centred on the glyph so digits line up
+    def __init__(self, font_size):
+        label = CoreLabel(font_size=font_size)
+        self.width = max(label.get_extents(c)[0] for c in GLYPHS)
+        # Spaces around every glyph keep neighbours out of its region
+        # and leave a blank region at the start
+        sep = ' ' * int(ceil(self.width / max(label.get_extents(' ')[0], 1)) + 1)
+        text = sep + sep.join(GLYPHS) + sep
+        label.text = text
+        label.refresh()
+        self.texture = texture = label.texture
+        self.height = texture.height
+        self.blank = texture.get_region(0, 0, self.width, self.height)
+        self.regions = {}
+        for i, c in enumerate(GLYPHS):
+            start = label.get_extents(text[:len(sep) + i * (len(sep) + 1)])[0]
+            center = start + label.get_extents(c)[0] / 2.0
+            self.regions[c] = texture.get_region(center - self.width / 2.0, 0, self.width, self.height)
+
+
+def get_glyph_set(font_size):
+    glyphs = _glyph_sets.get(font_size)
+    if glyphs is None:
+        glyphs = _glyph_sets[font_size] = GlyphSet(font_size)
+    return glyphs
+
+
+def get_text_texture(text, font_size):
+    # Static captions are rendered once and shared
+    texture = _text_textures.get((text, font_size))
+    if texture is None and text:
+        label = CoreLabel(text=text, font_size=font_size)
+        label.refresh()
+        texture = _text_textures[(text, font_size)] = label.texture
+    return texture
+
+
+class NumericReadout(Widget):
+    # A number between a static prefix and suffix ("Power: 42", "80%"),
+    # centred like a Label. Digits come from a cached GlyphSet drawn on a
+    # fixed row of quads, so an update only swaps texture regions and
+    # never renders text. Values wider than `digits` show as dashes.
+    value = NumericProperty(0)
+
+    def __init__(self, prefix='', suffix='', fmt='%d', digits=4, font_size=20, color=(1, 1, 1, 1), **kwargs):
+        super(NumericReadout, self).__init__(**kwargs)
+        self.fmt = fmt
+        self.digits = digits
+        self.glyphs = get_glyph_set(font_size)
+        self._prefix_texture = get_text_texture(prefix, font_size)
+        self._suffix_texture = get_text_texture(suffix, font_size)
+        self._text = None
+
+        with self.canvas:
+            self._color = Color(*color)
+            self._prefix = Rectangle(texture=self._prefix_texture)
+            self._quads = [Rectangle(texture=self.glyphs.blank) for i in range(digits)]
+            self._suffix = Rectangle(texture=self._suffix_texture)
+
+        self.bind(pos=self.update_layout, size=self.update_layout, value=self.update_value)
+        self.update_layout()
+        self.update_value()
+
+    @property
+    def color(self):
+        return self._color.rgba
+
+    @color.setter
+    def color(self, rgba):
+        self._color.rgba = rgba
+
+    def update_layout(self, *args):
+        glyphs = self.glyphs
+        prefix_size = self._prefix_texture.size if self._prefix_texture else (0, 0)
+        suffix_size = self._suffix_texture.size if self._suffix_texture else (0, 0)
+        width = prefix_size[0] + self.digits * glyphs.width + suffix_size[0]
+        x = self.center_x - width / 2.0
+        y = self.center_y - glyphs.height / 2.0
+        self._prefix.pos = (x, y)
+        self._prefix.size = prefix_size
+        x += prefix_size[0]
+        for quad in self._quads:
+            quad.pos = (x, y)
+            quad.size = (glyphs.width, glyphs.height)
+            x += glyphs.width
+        self._suffix.pos = (x, y)
+        self._suffix.size = suffix_size
+
+    def update_value(self, *args):
+        text = self.fmt % self.value
+        if text == self._text:
+            return
+        self._text = text
+        digits = self.digits
+        if len(text) > digits:
+            text = '-' * digits
+        regions = self.glyphs.regions
+        blank = self.glyphs.blank
+        # Right aligned so the units never move
+        pad = digits - len(text)
+        for i, quad in enumerate(self._quads):
+            quad.texture = regions.get(text[i - pad], blank) if i >= pad else blank
+
+
+class PerfOverlay(Label):
+    # Frame and latency figures from a Metrics object, hidden until toggled.
+    # Only refreshes while visible.
+    def __init__(self, metrics, refresh_interval=0.5, **kwargs):
+        kwargs.setdefault('font_size', 14)
+        kwargs.setdefault('halign', 'left')
+        kwargs.setdefault('valign', 'top')
+        super(PerfOverlay, self).__init__(**kwargs)
+        self.metrics = metrics
+        self.refresh_interval = refresh_interval
+        self.size_hint = (None, None)
+        self.size = (420, 200)
+        self.bind(size=self._update_text_size)
+        self._update_text_size()
+        self.opacity = 0
+        self._event = None
+
+    def _update_text_size(self, *args):
+        self.text_size = self.size
+
+    @property
+    def visible(self):
+        return self._event is not None
+
+    def toggle(self, *args):
+        if self._event is None:
+            self.opacity = 1
+            self._event = Clock.schedule_interval(self.refresh, self.refresh_interval)
+            self.refresh()
+        else:
+            self._event.cancel()
+            self._event = None
+            self.opacity = 0
+            self.text = ''
+
+    def refresh(self, *args):
+        data = self.metrics.dump()
+        frame = data['frame_time']
+        lines = ['FPS %.1f   frame p50 %.1f ms  p99 %.1f ms' % (data['fps'], frame['p50_ms'], frame['p99_ms'])]
+        for stage in ('draw_time', 'read_to_parse', 'parse_to_apply', 'apply_to_present', 'end_to_end'):
+            lines.append('%-17s p50 %7.2f ms  p99 %7.2f ms' % (stage, data[stage]['p50_ms'], data[stage]['p99_ms']))
+        source = data.get('source', {})
+        if 'bad_frames' in source:
+            lines.append('parse errors %d   dropped bytes %d' % (source['bad_frames'], source['dropped_bytes']))
+        scheduler = data.get('scheduler', {})
+        recorder = data.get('recorder', {})
+        lines.append('queue %d per frame, %d coalesced, recorder %d' % (
+            scheduler.get('batch', 0), scheduler.get('coalesced', 0), recorder.get('queue', 0)))
+        self.text = '\n'.join(lines)